@@ -4,10 +4,14 @@ OpenAI-compatible. Ollama-first on this box (32GB RAM beast).
 SSH relay: connect your own machine, inference runs there.
 Omni broadcast: axis sends bulletins to all connected terminals.
 """
-import json, time, uuid, os, subprocess, threading
+import json, time, uuid, os, subprocess, threading, queue, hashlib, heapq, math, sqlite3, atexit
+import http.client
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlsplit
 import urllib.request
+from amallo_keys import KeyStore, sov_token
 
 try:
     import paramiko
@@ -18,6 +22,16 @@ except ImportError:
 MODELS_DIR    = '/root/axis-mundi/models'
 KEYS_FILE     = '/root/amallo/keys.json'
 PORT          = 8200
+WORKERS       = int(os.environ.get('AMALLO_WORKERS', 32))   # concurrent connections served
+KEEPALIVE_S   = 15                                         # idle keep-alive before a worker is freed
+STREAM_FRAME_MS    = 25     # coalesce tokens arriving faster than this into one SSE frame
+STREAM_FRAME_CHARS = 256    # ...up to this many characters
+# Any Ollama-compatible server: ollama itself, or gguf_server.py (:8300) to share its model pool
+OLLAMA_URL    = os.environ.get('OLLAMA_URL', 'http://127.0.0.1:11434').rstrip('/')
+# Keep models (and their prompt cache) resident between turns
+OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '30m')
+# Optional gguf_server.py instances whose /v1/models join the inventory (comma-separated URLs)
+GGUF_SERVERS  = [u.strip().rstrip('/') for u in os.environ.get('AMALLO_GGUF_SERVERS', '').split(',') if u.strip()]
 
 OLLAMA_MODELS = {
     'dolphin':         'dolphin-mistral',
@@ -47,58 +61,446 @@ def ssh_cleanup():
         time.sleep(300)
         now = time.time()
         with ssh_lock:
-            dead = [k for k, v in ssh_sessions.items() if now - v['ts'] > SSH_TIMEOUT]
-            for k in dead:
-                try: ssh_sessions[k]['client'].close()
-                except: pass
-                del ssh_sessions[k]
+            dead = [ssh_sessions.pop(k) for k, v in list(ssh_sessions.items())
+                    if now - v['ts'] > SSH_TIMEOUT]
+        for sess in dead:
+            ssh_close(sess)
 
 threading.Thread(target=ssh_cleanup, daemon=True).start()
 
-# Omni broadcast
-omni_msg = {'text': '', 'from': '', 'ts': 0, 'active': False}
-
-class KeyManager:
+# Omni broadcast — the latest message stays pollable at /amallo/omni; every
+# broadcast is also pushed to /amallo/omni/stream subscribers (SSE).
+omni_msg  = {'text': '', 'from': '', 'ts': 0, 'active': False}
+omni_lock = threading.Lock()
+OMNI_REPLAY      = 100                    # broadcasts kept for Last-Event-ID replay
+OMNI_QUEUE       = 64                     # per-subscriber backlog before it is cut loose
+OMNI_HEARTBEAT   = 15                     # seconds between SSE keep-alive comments
+OMNI_SUBSCRIBERS = max(1, WORKERS // 2)   # each subscriber holds a worker thread
+
+class OmniHub:
+    """Fan-out of omni broadcasts. publish() never blocks: each subscriber has
+    its own bounded queue, and one that falls OMNI_QUEUE behind is dropped
+    (it reconnects with Last-Event-ID and replays what it missed)."""
     def __init__(self):
-        self.keys = {}
-        self._load()
+        self.seq    = 0
+        self.replay = deque(maxlen=OMNI_REPLAY)
+        self.subs   = set()
+        self.lock   = threading.Lock()
+        self.dropped = 0
+
+    def publish(self, msg):
+        with self.lock:
+            self.seq += 1
+            event = (self.seq, json.dumps(msg))
+            self.replay.append(event)
+            # Only publish() and subscribe() fill queues, both under the lock, so
+            # a backlog under OMNI_QUEUE always has room and a full one still has
+            # the spare slot for the disconnect sentinel: nothing here can block.
+            for q in list(self.subs):
+                if q.qsize() < OMNI_QUEUE:
+                    q.put_nowait(event)
+                else:
+                    self.subs.discard(q)
+                    q.put_nowait(None)   # fell behind: client reconnects with Last-Event-ID
+                    self.dropped += 1
+        return event[0]
+
+    def subscribe(self, last_id=None):
+        """Return a queue pre-loaded with missed events, or None when full."""
+        q = queue.Queue(maxsize=OMNI_QUEUE + 1)
+        with self.lock:
+            if len(self.subs) >= OMNI_SUBSCRIBERS:
+                return None
+            if last_id is not None:
+                for event in [e for e in self.replay if e[0] > last_id][-OMNI_QUEUE:]:
+                    q.put_nowait(event)
+            self.subs.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subs.discard(q)
+
+    def status(self):
+        with self.lock:
+            return {'subscribers': len(self.subs), 'last_id': self.seq, 'dropped': self.dropped}
+
+omni_hub = OmniHub()
+
+# ── BACKEND CLIENT ────────────────────────────────────────────────────────────
+# Keep-alive connection pool per upstream, a circuit breaker that fails fast
+# while the upstream is down, and a background prober that closes it again.
+BREAKER_FAILURES = 3     # consecutive failures that open the circuit
+BREAKER_COOLDOWN = 15    # seconds open before a half-open trial request
+PROBE_EVERY      = 10    # seconds between background health probes
+POOL_IDLE_MAX    = 8     # idle keep-alive connections kept per upstream
+
+class UpstreamUnavailable(Exception):
+    """Raised without touching the network while an upstream's circuit is open."""
+
+class Upstream:
+    def __init__(self, name, base_url, probe_path='/api/tags', connect=None):
+        u = urlsplit(base_url)
+        self.name, self.base_url, self.probe_path = name, base_url, probe_path
+        self.connect = connect         # optional factory(timeout) -> HTTPConnection
+        self.https = u.scheme == 'https'
+        self.host  = u.hostname or '127.0.0.1'
+        self.port  = u.port or (443 if self.https else 80)
+        self.idle  = []
+        self.lock  = threading.Lock()
+        self.state = 'closed'          # closed | open | half_open
+        self.failures  = 0
+        self.opened_at = 0.0
+        self.trial     = False         # half-open trial in flight
+        self.healthy   = None
+        self.stats = {'requests': 0, 'errors': 0, 'fast_fails': 0, 'opened': 0,
+                      'reused': 0, 'connects': 0, 'ttfb_ms': None, 'total_ms': None,
+                      'last_error': None, 'last_probe': 0}
+
+    # ── breaker ──────────────────────────────────────────────────
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.time() - self.opened_at >= BREAKER_COOLDOWN:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self.trial:
+                self.trial = True
+                return True
+            self.stats['fast_fails'] += 1
+            return False
+
+    def _ok(self):
+        with self.lock:
+            self.state, self.failures, self.trial, self.healthy = 'closed', 0, False, True
+
+    def _fail(self, err):
+        with self.lock:
+            self.failures += 1
+            self.stats['errors'] += 1
+            self.stats['last_error'] = f'{type(err).__name__}: {err}'[:200]
+            self.trial = False
+            if self.state == 'half_open' or self.failures >= BREAKER_FAILURES:
+                if self.state != 'open':
+                    self.stats['opened'] += 1
+                self.state, self.opened_at, self.healthy = 'open', time.time(), False
+
+    def _ewma(self, key, seconds):
+        prev = self.stats[key]
+        ms = seconds * 1000
+        self.stats[key] = round(ms if prev is None else 0.8 * prev + 0.2 * ms, 1)
+
+    # ── pool ─────────────────────────────────────────────────────
+    def _connect(self, timeout):
+        if self.connect:
+            return self.connect(timeout)
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=timeout)
+
+    def _acquire(self, timeout):
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+            self.stats['reused' if conn else 'connects'] += 1
+        if conn is None:
+            return self._connect(timeout), False
+        conn.timeout = timeout
+        if conn.sock:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _release(self, conn):
+        with self.lock:
+            if len(self.idle) < POOL_IDLE_MAX:
+                self.idle.append(conn); return
+        conn.close()
+
+    def _open(self, method, path, payload, timeout, headers=None, info=None):
+        if not self.allow():
+            raise UpstreamUnavailable(f'{self.name} circuit open ({self.stats["last_error"]})')
+        body = json.dumps(payload).encode() if payload is not None else None
+        headers = dict(headers or {})
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        with self.lock:
+            self.stats['requests'] += 1
+        for attempt in (0, 1):
+            conn, reused = self._acquire(timeout)
+            connect_s = 0.0
+            try:
+                if not reused:
+                    tc = time.perf_counter(); conn.connect(); connect_s = time.perf_counter() - tc
+                t0 = time.perf_counter()
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, OSError) as e:
+                conn.close()
+                if reused and attempt == 0 and not isinstance(e, TimeoutError):
+                    continue   # stale keep-alive socket/channel; retry once on a fresh one
+                self._fail(e); raise
+            except Exception as e:
+                conn.close(); self._fail(e); raise
+            with self.lock:
+                self._ewma('ttfb_ms', time.perf_counter() - t0)
+            if info is not None:
+                info.update({'reused': reused, 'connect_ms': round(connect_s * 1000, 1),
+                             'ttfb_ms': round((time.perf_counter() - t0) * 1000, 1)})
+            if resp.status >= 500:
+                err = http.client.HTTPException(f'{resp.status} {resp.read()[:200]!r}')
+                self._release(conn); self._fail(err); raise err
+            return conn, resp, t0
+
+    # ── API ──────────────────────────────────────────────────────
+    def request(self, method, path, payload=None, timeout=180, headers=None, info=None):
+        """Return (status, parsed JSON body). Raises on transport errors or 5xx.
+        If info is a dict it receives reused/connect_ms/ttfb_ms/total_ms."""
+        conn, resp, t0 = self._open(method, path, payload, timeout, headers, info)
+        try:
+            raw = resp.read()
+        except Exception as e:
+            conn.close(); self._fail(e); raise
+        self._release(conn)
+        self._ok()
+        with self.lock:
+            self._ewma('total_ms', time.perf_counter() - t0)
+        if info is not None:
+            info['total_ms'] = round((time.perf_counter() - t0) * 1000, 1)
+        try:
+            return resp.status, json.loads(raw) if raw else {}
+        except ValueError:
+            return resp.status, {'raw': raw.decode('utf-8', errors='replace')}
+
+    def stream(self, method, path, payload=None, timeout=180, headers=None, info=None):
+        """Yield raw response lines. The connection goes back to the pool only if
+        the body was read to the end; closing the generator early drops it."""
+        conn, resp, t0 = self._open(method, path, payload, timeout, headers, info)
+        done = False
+        try:
+            for line in resp:
+                yield line
+            done = True
+        except Exception as e:
+            self._fail(e); raise
+        finally:
+            if done:
+                self._release(conn); self._ok()
+                with self.lock:
+                    self._ewma('total_ms', time.perf_counter() - t0)
+            else:
+                conn.close()
 
-    def _load(self):
-        if os.path.exists(KEYS_FILE):
-            with open(KEYS_FILE) as f:
-                self.keys = json.load(f)
-        else:
-            master = self._gen('marcus', 'master')
-            print(f'[AMALLO] Bootstrap master key: {master}')
-
-    def _save(self):
-        os.makedirs(os.path.dirname(KEYS_FILE), exist_ok=True)
-        with open(KEYS_FILE, 'w') as f:
-            json.dump(self.keys, f, indent=2)
-
-    def _gen(self, identity, role='user'):
-        import secrets, string
-        alphabet = string.ascii_letters + string.digits
-        rand = ''.join(secrets.choice(alphabet) for _ in range(40))
-        key = 'sov' + rand
-        self.keys[key] = {'identity': identity, 'role': role,
-                          'created': time.strftime('%Y-%m-%dT%H:%M:%SZ'), 'requests': 0}
-        self._save()
-        return key
-
-    def validate(self, header):
-        key = (header or '').replace('Bearer ', '').strip()
-        if key in self.keys:
-            self.keys[key]['requests'] += 1
-            self._save()
-            return True, self.keys[key]
-        return False, None
-
-    def create(self, identity, role='user'):
-        return self._gen(identity, role)
-
-    def list_keys(self):
-        return self.keys
+    def probe(self):
+        """Health check over a pooled keep-alive connection, which goes back to
+        the pool afterwards: probing a tunnelled upstream must not open a fresh
+        direct-tcpip channel every PROBE_EVERY seconds."""
+        try:
+            for attempt in (0, 1):
+                with self.lock:
+                    conn = self.idle.pop() if self.idle else None
+                reused = conn is not None
+                conn = conn or self._connect(2)
+                try:
+                    conn.timeout = 2
+                    if conn.sock:
+                        conn.sock.settimeout(2)
+                    conn.request('GET', self.probe_path)
+                    resp = conn.getresponse(); resp.read()
+                    break
+                except Exception as e:
+                    conn.close()
+                    if not (reused and attempt == 0 and isinstance(e, (http.client.RemoteDisconnected, OSError))
+                            and not isinstance(e, TimeoutError)):
+                        raise   # a stale keep-alive socket/channel gets one retry on a fresh one
+            self._release(conn)
+            if resp.status >= 500:
+                raise http.client.HTTPException(f'probe {resp.status}')
+            self._ok()
+        except Exception as e:
+            with self.lock:
+                self.healthy = False
+            if self.state == 'closed':
+                self._fail(e)
+        finally:
+            self.stats['last_probe'] = int(time.time())
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+    def status(self):
+        with self.lock:
+            return {'url': self.base_url, 'state': self.state, 'healthy': self.healthy,
+                    'consecutive_failures': self.failures, 'idle_conns': len(self.idle),
+                    **self.stats}
+
+UPSTREAMS      = {'ollama': Upstream('ollama', OLLAMA_URL)}
+UPSTREAMS_LOCK = threading.Lock()
+
+def upstream_prober():
+    while True:
+        with UPSTREAMS_LOCK:
+            ups = list(UPSTREAMS.values())
+        for up in ups:
+            try: up.probe()
+            except Exception: pass
+        time.sleep(PROBE_EVERY)
+
+threading.Thread(target=upstream_prober, daemon=True).start()
+
+# ── SSH TUNNELS ───────────────────────────────────────────────────────────────
+# Each SSH session gets pooled Upstreams whose connections are direct-tcpip
+# channels on the session's transport, so remote inference is plain keep-alive
+# HTTP (streaming, cancellation, breaker) instead of a curl per request.
+class TunnelConnection(http.client.HTTPConnection):
+    """HTTPConnection whose socket is a paramiko direct-tcpip channel."""
+    def __init__(self, sess, remote_port, timeout):
+        super().__init__('127.0.0.1', remote_port, timeout=timeout)
+        self.sess = sess
+
+    def connect(self):
+        t0 = time.perf_counter()
+        self.sock = self.sess['client'].get_transport().open_channel(
+            'direct-tcpip', ('127.0.0.1', self.port), ('127.0.0.1', 0), timeout=self.timeout)
+        self.sock.settimeout(self.timeout)
+        rtt = (time.perf_counter() - t0) * 1000   # channel open = one SSH round trip
+        prev = self.sess.get('ssh_rtt_ms')
+        self.sess['ssh_rtt_ms'] = round(rtt if prev is None else 0.8 * prev + 0.2 * rtt, 1)
+        self.sess['tunnels_opened'] = self.sess.get('tunnels_opened', 0) + 1
+
+def ssh_tunnels(sid, sess):
+    """Attach tunnelled Upstreams for the node's Ollama (:11434) and Amallo (:8200)."""
+    node = f"{sess['user']}@{sess['host']}"
+    for name, port, probe in (('ollama', 11434, '/api/tags'), ('amallo', 8200, '/health')):
+        sess[name] = Upstream(f'ssh:{name}:{node}:{sid[:6]}', f'http://127.0.0.1:{port}',
+                              probe_path=probe,
+                              connect=lambda timeout, port=port: TunnelConnection(sess, port, timeout))
+    with UPSTREAMS_LOCK:
+        UPSTREAMS[sess['ollama'].name] = sess['ollama']   # probed + shown on /amallo/status
+
+def ssh_close(sess):
+    if 'ollama' in sess:
+        with UPSTREAMS_LOCK:
+            UPSTREAMS.pop(sess['ollama'].name, None)
+        sess['ollama'].close(); sess['amallo'].close()
+    try: sess['client'].close()
+    except: pass
+
+# ── MODEL INVENTORY ───────────────────────────────────────────────────────────
+# Metadata endpoints serve the last known model list instantly; a background
+# thread refreshes it every INVENTORY_EVERY seconds, or sooner on request.
+INVENTORY_EVERY = 30
+INVENTORY_STALE = 3 * INVENTORY_EVERY   # age past which a snapshot is flagged stale
+
+for _url in GGUF_SERVERS:
+    UPSTREAMS['gguf:' + _url] = Upstream('gguf:' + _url, _url, probe_path='/health')
+
+# Ollama-serving peers from mesh.json join as 'mesh:<id>' upstreams (this node excluded)
+MESH_FILE = os.environ.get('AMALLO_MESH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mesh.json'))
+NODE_ID   = os.environ.get('AMALLO_NODE_ID', 'model')
+
+def mesh_peers():
+    try:
+        with open(MESH_FILE) as f:
+            nodes = json.load(f).get('nodes', {})
+    except (OSError, ValueError):
+        return {}
+    return {nid: f"http://{n['ip']}:{n.get('ollama_port', 11434)}"
+            for nid, n in nodes.items()
+            if nid != NODE_ID and n.get('ip') and n.get('status') == 'active'
+            and 'ollama' in n.get('services', [])}
+
+for _nid, _url in mesh_peers().items():
+    UPSTREAMS['mesh:' + _nid] = Upstream('mesh:' + _nid, _url)
+
+class ModelInventory:
+    def __init__(self):
+        self.sources   = {}               # source -> [model names]
+        self.updated   = {}               # source -> last successful fetch (epoch)
+        self.errors    = {}               # source -> last error
+        self.changes   = deque(maxlen=50) # recent change events, newest last
+        self.listeners = []               # callables(event) fired on change
+        self.lock      = threading.Lock()
+        self.wake      = threading.Event()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _fetch(self, source):
+        up = UPSTREAMS[source]
+        if not source.startswith('gguf:'):
+            _, d = up.request('GET', '/api/tags', timeout=5)
+            return sorted(m['name'] for m in d.get('models', []))
+        _, d = up.request('GET', '/v1/models', timeout=5)
+        return sorted(m['id'] for m in d.get('data', []))
+
+    def refresh(self):
+        """Fetch every source now (blocking). Emits a change event on diffs."""
+        before = set(self.all())
+        for source in [n for n in list(UPSTREAMS) if n == 'ollama' or n.startswith(('gguf:', 'mesh:'))]:
+            try:
+                names = self._fetch(source)
+                with self.lock:
+                    self.sources[source] = names
+                    self.updated[source] = time.time()
+                    self.errors.pop(source, None)
+            except Exception as e:
+                with self.lock:
+                    self.errors[source] = str(e)[:200]   # keep last known list
+        after = set(self.all())
+        if after != before:
+            event = {'ts': int(time.time()), 'added': sorted(after - before),
+                     'removed': sorted(before - after)}
+            with self.lock:
+                self.changes.append(event)
+                listeners = list(self.listeners)
+            print(f"[AMALLO] models changed: +{event['added']} -{event['removed']}")
+            for fn in listeners:
+                try: fn(event)
+                except Exception: pass
+
+    def request_refresh(self):
+        self.wake.set()
+
+    def subscribe(self, fn):
+        with self.lock:
+            self.listeners.append(fn)
+
+    def _loop(self):
+        while True:
+            self.refresh()
+            self.wake.wait(INVENTORY_EVERY)
+            self.wake.clear()
+
+    def ollama(self):
+        with self.lock:
+            return list(self.sources.get('ollama', []))
+
+    def all(self):
+        with self.lock:
+            return list(dict.fromkeys(m for names in self.sources.values() for m in names))
+
+    def serving(self, model):
+        """Sources that list model (with or without the ':latest' tag)."""
+        want = {model, model + ':latest'} if ':' not in model else {model, model.split(':')[0]}
+        with self.lock:
+            return [src for src, names in self.sources.items() if want & set(names)]
+
+    def freshness(self):
+        """Oldest source update and whether any source is past INVENTORY_STALE."""
+        with self.lock:
+            oldest = min(self.updated.values()) if self.updated else 0
+        return {'updated': int(oldest), 'stale': time.time() - oldest > INVENTORY_STALE}
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            return {'sources': {src: {'models': names,
+                                      'updated': int(self.updated.get(src, 0)),
+                                      'age_s': round(now - self.updated[src], 1) if src in self.updated else None,
+                                      'stale': now - self.updated.get(src, 0) > INVENTORY_STALE,
+                                      'error': self.errors.get(src)}
+                                for src, names in self.sources.items()},
+                    'errors': dict(self.errors),
+                    'changes': list(self.changes)}
 
 class ModelManager:
     def __init__(self):
@@ -112,13 +514,7 @@ class ModelManager:
         return OLLAMA_MODELS.get(n, n)
 
     def available_ollama(self):
-        try:
-            req = urllib.request.Request('http://127.0.0.1:11434/api/tags')
-            with urllib.request.urlopen(req, timeout=5) as r:
-                d = json.loads(r.read())
-                return [m['name'] for m in d.get('models', [])]
-        except:
-            return []
+        return inventory.ollama()
 
     def available_gguf(self):
         if not os.path.exists(MODELS_DIR):
@@ -126,13 +522,88 @@ class ModelManager:
         return [f for f in os.listdir(MODELS_DIR) if f.endswith('.gguf')]
 
     def available(self):
-        return self.available_ollama() + self.available_gguf()
+        return inventory.all() + self.available_gguf()
 
     def switch(self, name):
         resolved = self.resolve_ollama(name)
         self.current = resolved
+        if resolved not in inventory.all() and resolved + ':latest' not in inventory.all():
+            inventory.request_refresh()   # maybe just pulled
         return True, resolved
 
+inventory = ModelInventory()
+
+# ── MESH ROUTING ──────────────────────────────────────────────────────────────
+# Chat inference goes to the best Ollama node that has the model: fewest
+# in-flight requests, weighted by that node's EWMA time-to-first-byte. Open
+# circuits sort last. On failure the next node is tried. A client that sends a
+# session key ('session' in the body or X-Amallo-Session) sticks to the node
+# that last served it, keeping that node's prompt cache warm.
+AFFINITY_TTL   = 1800   # seconds a session stays pinned after its last request
+ROUTE_DEFAULT_MS = 100  # assumed TTFB for nodes with no history yet
+
+class Router:
+    def __init__(self):
+        self.nodes    = ['ollama'] + sorted(n for n in UPSTREAMS if n.startswith('mesh:'))
+        self.inflight = {n: 0 for n in self.nodes}
+        self.served   = {n: 0 for n in self.nodes}
+        self.failed   = {n: 0 for n in self.nodes}
+        self.failovers = 0
+        self.affinity = {}   # session key -> (node, last used)
+        self.last_active = time.time()
+        self.lock     = threading.Lock()
+
+    def _score(self, n):
+        up = UPSTREAMS[n]
+        return (up.state == 'open', (self.inflight[n] + 1) * (up.stats['ttfb_ms'] or ROUTE_DEFAULT_MS))
+
+    def candidates(self, model, key=None):
+        have = [n for n in self.nodes if n in inventory.serving(model)] or ['ollama']
+        with self.lock:
+            order = sorted(have, key=self._score)
+            pin = self.affinity.get(key) if key else None
+            if pin and time.time() - pin[1] < AFFINITY_TTL and pin[0] in order \
+                    and UPSTREAMS[pin[0]].state != 'open':
+                order.remove(pin[0]); order.insert(0, pin[0])
+        return order
+
+    def idle_for(self):
+        """Seconds since the last inference started or finished; 0 while any run."""
+        with self.lock:
+            return 0 if any(self.inflight.values()) else time.time() - self.last_active
+
+    def begin(self, n):
+        with self.lock:
+            self.inflight[n] += 1
+            self.last_active = time.time()
+
+    def end(self, n, ok, key=None, failover=False):
+        with self.lock:
+            self.inflight[n] -= 1
+            self.last_active = time.time()
+            if ok:
+                self.served[n] += 1
+                if key:
+                    self.affinity[key] = (n, time.time())
+                    if len(self.affinity) > 4096:   # drop expired pins
+                        cutoff = time.time() - AFFINITY_TTL
+                        self.affinity = {k: v for k, v in self.affinity.items() if v[1] > cutoff}
+            elif ok is False:   # None = client went away; not the node's fault
+                self.failed[n] += 1
+            if ok and failover:
+                self.failovers += 1
+
+    def status(self):
+        with self.lock:
+            return {'nodes': {n: {'inflight': self.inflight[n], 'served': self.served[n],
+                                  'failed': self.failed[n], 'state': UPSTREAMS[n].state,
+                                  'ttfb_ms': UPSTREAMS[n].stats['ttfb_ms'],
+                                  'models': len(inventory.sources.get(n, []))}
+                              for n in self.nodes},
+                    'failovers': self.failovers, 'pinned_sessions': len(self.affinity)}
+
+router = Router()
+
 
 # ── Buddy identities — each model knows Marcus and has a name ────────
 BUDDY_NAMES = {
@@ -172,23 +643,36 @@ YOUR RULES AS HIS BUDDY:
 4. Never pretend to be stateless. You are a continuous mind on his continuous node."""
 
 def inject_sovereign_context(model_name, messages):
-    """Prepend Marcus profile + buddy identity as system message if not already present."""
-    name = BUDDY_NAMES.get(model_name.split(':')[0].lower(), 'Amallo')
-    has_system = any(m.get('role') == 'system' for m in messages)
-    system_content = f"Your name is {name}.\n{MARCUS_PROFILE}"
-    if has_system:
-        # prepend to existing system message
-        new_messages = []
-        for m in messages:
-            if m.get('role') == 'system':
-                new_messages.append({'role': 'system', 'content': system_content + '\n\n' + m['content']})
-            else:
-                new_messages.append(m)
-        return new_messages
-    else:
-        return [{'role': 'system', 'content': system_content}] + messages
-
+    """Lay out messages so every request for a model starts with the same bytes.
 
+    One system message leads: the buddy persona (identical for every request to
+    this model), then any client system text. Every other message follows in
+    its original order, trimmed to role/content. Ollama's prompt cache can then
+    reuse the evaluated persona prefix on every turn.
+    """
+    name = BUDDY_NAMES.get(model_name.split(':')[0].lower(), 'Amallo')
+    system = [f"Your name is {name}.\n{MARCUS_PROFILE}"]
+    rest = []
+    for m in messages:
+        content = m.get('content', '')
+        if not isinstance(content, str):
+            content = json.dumps(content, sort_keys=True)
+        if m.get('role') == 'system':
+            system.append(content)
+        else:
+            msg = {'role': m.get('role', 'user'), 'content': content}
+            if m.get('images'):
+                msg['images'] = m['images']
+            rest.append(msg)
+    return [{'role': 'system', 'content': '\n\n'.join(system)}] + rest
+
+def chat_payload(model_name, messages, max_tokens, temperature, stream):
+    """Ollama /api/chat request body for already-laid-out messages."""
+    return {'model': model_name, 'messages': messages, 'stream': stream,
+            'keep_alive': OLLAMA_KEEP_ALIVE,
+            'options': {'num_predict': max_tokens, 'temperature': temperature}}
+
+def build_prompt(messages):
     prompt = ''
     for m in messages:
         role = m.get('role', 'user')
@@ -199,17 +683,25 @@ def inject_sovereign_context(model_name, messages):
     prompt += '<|assistant|>\n'
     return prompt
 
-def run_inference(model_name, messages, max_tokens=2048, temperature=0.7):
+def run_inference(model_name, messages, max_tokens=2048, temperature=0.7, route_key=None, info=None):
+    """Routed across mesh nodes (see Router); llama-cli is the last resort.
+    If info is a dict it receives the serving node."""
+    payload = chat_payload(model_name, messages, max_tokens, temperature, False)
+    for i, n in enumerate(router.candidates(model_name, route_key)):
+        router.begin(n)
+        try:
+            _, d = UPSTREAMS[n].request('POST', '/api/chat', payload)
+            result = d.get('message', {}).get('content', '')
+        except Exception:
+            result = ''
+        router.end(n, bool(result), route_key, failover=i > 0)
+        if result:
+            if info is not None:
+                info['node'] = n
+                info['stats'] = {k: v for k, v in d.items() if k.endswith(('_count', '_duration'))}
+            return result
+
     prompt = build_prompt(messages)
-    try:
-        data = json.dumps({'model': model_name, 'prompt': prompt, 'stream': False,
-                           'options': {'num_predict': max_tokens, 'temperature': temperature}}).encode()
-        req = urllib.request.Request('http://127.0.0.1:11434/api/generate', data=data, method='POST')
-        req.add_header('Content-Type', 'application/json')
-        with urllib.request.urlopen(req, timeout=180) as r:
-            result = json.loads(r.read()).get('response', '')
-            if result: return result
-    except: pass
 
     for cli in ['/usr/local/bin/llama-cli', '/usr/bin/llama-cli']:
         if os.path.exists(cli):
@@ -228,120 +720,1397 @@ def run_inference(model_name, messages, max_tokens=2048, temperature=0.7):
 
     return '[No inference backend available. Run: ollama pull dolphin-mistral]'
 
-def run_inference_stream(model_name, messages, max_tokens=2048, temperature=0.7):
-    """Generator: yields SSE-formatted chunks for streaming responses."""
-    prompt = build_prompt(messages)
-    model_id = 'amallo-' + uuid.uuid4().hex[:8]
-    created = int(time.time())
-    try:
-        data = json.dumps({'model': model_name, 'prompt': prompt, 'stream': True,
-                           'options': {'num_predict': max_tokens, 'temperature': temperature}}).encode()
-        req = urllib.request.Request('http://127.0.0.1:11434/api/generate', data=data, method='POST')
-        req.add_header('Content-Type', 'application/json')
-        with urllib.request.urlopen(req, timeout=180) as r:
-            for raw_line in r:
-                line = raw_line.decode('utf-8', errors='replace').strip()
-                if not line: continue
-                try:
-                    chunk = json.loads(line)
-                    token = chunk.get('response', '')
-                    if token:
-                        payload = json.dumps({
-                            'id': model_id, 'object': 'chat.completion.chunk',
-                            'created': created, 'model': model_name,
-                            'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': token},
-                                         'finish_reason': None}]
-                        })
-                        yield f'data: {payload}\n\n'.encode()
-                    if chunk.get('done'):
-                        yield b'data: [DONE]\n\n'
+def _chat_events(up, payload):
+    """Token/done events from one upstream's /api/chat stream; raises on failure."""
+    done = None
+    for raw_line in up.stream('POST', '/api/chat', payload, timeout=300):
+        if done is not None or not raw_line.strip():
+            continue   # drain to EOF so the connection is reusable
+        try:
+            chunk = json.loads(raw_line)
+        except ValueError:
+            continue
+        token = chunk.get('message', {}).get('content', '')
+        if token:
+            yield {'type': 'token', 'text': token}
+        if chunk.get('done'):
+            done = {k: v for k, v in chunk.items() if k.endswith(('_count', '_duration'))}
+    if done is None:
+        raise ConnectionError('upstream closed before done')
+    yield {'type': 'done', 'stats': done}
+
+def run_inference_stream(model_name, messages, max_tokens=2048, temperature=0.7,
+                         upstream=None, route_key=None):
+    """Generator of token events from Ollama's /api/chat stream:
+      {'type': 'token', 'text': str}
+      {'type': 'done',  'stats': {prompt_eval_count, eval_count, ...}, 'node': str}
+      {'type': 'error', 'error': str}
+    Without an explicit upstream the request is routed across mesh nodes, and
+    fails over to the next node if one dies before its first token. Closing
+    the generator early closes the upstream connection, which makes Ollama
+    abort the generation."""
+    payload = chat_payload(model_name, messages, max_tokens, temperature, True)
+    nodes = [(None, upstream)] if upstream else \
+            [(n, UPSTREAMS[n]) for n in router.candidates(model_name, route_key)]
+    for i, (n, up) in enumerate(nodes):
+        started, ok = False, False
+        if n: router.begin(n)
+        try:
+            for ev in _chat_events(up, payload):
+                started = True
+                if ev['type'] == 'done':
+                    ok = True
+                    ev['node'] = n or up.name
+                yield ev
+            return
+        except GeneratorExit:
+            ok = None   # client went away
+            raise
+        except Exception as e:
+            if started or i == len(nodes) - 1:
+                yield {'type': 'error', 'error': str(e)}
+                return
+        finally:
+            if n: router.end(n, ok, route_key, failover=i > 0)
+
+# ── SINGLE-FLIGHT ─────────────────────────────────────────────────────────────
+# Identical deterministic requests (retries, double-submits, the same question
+# on two channels) share one generation. The generation runs on its own thread
+# and records its events; every request, the first included, replays them from
+# the start and then follows live, so late joiners get the tokens so far. It
+# is cancelled once the last subscriber has gone.
+class Flight:
+    def __init__(self, key, source):
+        self.key, self.source = key, source
+        self.events = []
+        self.subs   = 1
+        self.done   = False
+        self.cond   = threading.Condition()
+
+    def run(self):
+        try:
+            for ev in self.source:
+                with self.cond:
+                    self.events.append(ev)
+                    self.cond.notify_all()
+                    if self.subs == 0:
+                        self.done = True   # nobody left; closing the source aborts upstream
+                        break
+        finally:
+            self.source.close()
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
+            singleflight.finish(self)
+
+    def follow(self):
+        i = 0
+        try:
+            while True:
+                with self.cond:
+                    while i >= len(self.events) and not self.done:
+                        self.cond.wait()
+                    batch, i = self.events[i:], len(self.events)
+                    if not batch:
                         return
-                except: continue
-    except Exception as e:
-        err = json.dumps({'id': model_id, 'object': 'chat.completion.chunk', 'created': created,
-                          'model': model_name,
-                          'choices': [{'index': 0, 'delta': {'content': f'[Stream error: {e}]'},
-                                       'finish_reason': 'stop'}]})
-        yield f'data: {err}\n\n'.encode()
-    yield b'data: [DONE]\n\n'
-
-def run_inference_ssh(sess, messages, model, max_tokens, temperature):
-    client = sess['client']
-    prompt = build_prompt(messages)
-    payload = json.dumps({'model': model, 'prompt': prompt, 'stream': False,
-                          'options': {'num_predict': max_tokens, 'temperature': temperature}})
+                yield from batch
+        finally:
+            with self.cond:
+                self.subs -= 1
+
+class SingleFlight:
+    def __init__(self):
+        self.flights = {}
+        self.lock    = threading.Lock()
+        self.stats   = {'leaders': 0, 'joined': 0, 'joined_midstream': 0}
+
+    @staticmethod
+    def key(model_name, messages, max_tokens, temperature, stream=False, lane='interactive'):
+        """stream and lane pick the event source (incremental vs one final
+        token, preemptible batch vs interactive), so they split flights too."""
+        norm = [{'role': m.get('role'), 'content': str(m.get('content', '')).strip(),
+                 'images': m.get('images')} for m in messages]
+        blob = json.dumps([model_name, norm, max_tokens, temperature, bool(stream), lane],
+                          sort_keys=True)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def events(self, key, start):
+        """Return (event generator, joined). start() makes the event source
+        and is only called if no identical flight is in the air."""
+        with self.lock:
+            f = self.flights.get(key)
+            if f:
+                with f.cond:
+                    live = not f.done
+                    if live:
+                        f.subs += 1
+                if live:
+                    self.stats['joined'] += 1
+                    if f.events:
+                        self.stats['joined_midstream'] += 1
+                    return f.follow(), True
+            f = self.flights[key] = Flight(key, start())
+            self.stats['leaders'] += 1
+        threading.Thread(target=f.run, daemon=True).start()
+        return f.follow(), False
+
+    def live(self, key):
+        with self.lock:
+            f = self.flights.get(key)
+        return bool(f) and not f.done
+
+    def finish(self, f):
+        with self.lock:
+            if self.flights.get(f.key) is f:
+                del self.flights[f.key]
+
+    def status(self):
+        with self.lock:
+            return dict(self.stats, inflight=len(self.flights))
+
+singleflight = SingleFlight()
+
+def inference_events(model_name, messages, max_tokens=2048, temperature=0.7, route_key=None):
+    """run_inference() (llama-cli fallback included) as a token/done event pair."""
+    route = {}
+    text = run_inference(model_name, messages, max_tokens, temperature, route_key, route)
+    yield {'type': 'token', 'text': text}
+    yield {'type': 'done', 'stats': route.get('stats', {}), 'node': route.get('node', 'llama-cli')}
+
+class EventPump:
+    """Drives an event generator on its own thread so a relay can wait on it
+    with a deadline. close() asks the source to stop; the pump thread closes
+    it after the event in progress (a running generator can't be closed from
+    another thread)."""
+    END = object()
+
+    def __init__(self, events):
+        self.events = events
+        self.q      = queue.Queue()
+        self.stop   = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            for ev in self.events:
+                if self.stop.is_set():
+                    break
+                self.q.put(ev)
+            self.q.put(self.END)
+        except Exception as e:
+            self.q.put(e)
+        finally:
+            self.events.close()
+
+    def get(self, timeout=None):
+        """Next event, or None at the end. Raises queue.Empty on timeout and
+        re-raises whatever the source raised."""
+        ev = self.q.get(timeout=timeout)
+        if isinstance(ev, Exception):
+            raise ev
+        return None if ev is self.END else ev
+
+    def close(self):
+        self.stop.set()
+
+# ── FAIR QUEUE ────────────────────────────────────────────────────────────────
+# Inference runs on INFER_SLOTS slots (the upstreams' real parallelism).
+# Waiters are dispatched by weighted fair queuing across key identities: each
+# request is tagged max(virtual time, identity's last tag) + 1/weight and the
+# smallest tag goes next, so a key firing a fleet of jobs queues behind its
+# own backlog instead of everyone else's. Per-key token buckets cap request
+# rate and generated tokens; keys.json records may set 'weight', 'rpm' and
+# 'tpm' (0 = unlimited). Master keys are unlimited unless they set their own.
+# A record may also pin its 'lane'.
+OLLAMA_PARALLEL = int(os.environ.get('OLLAMA_NUM_PARALLEL', 1))
+INFER_SLOTS     = int(os.environ.get('AMALLO_INFER_SLOTS', 0)) or OLLAMA_PARALLEL * len(router.nodes)
+RATE_RPM        = float(os.environ.get('AMALLO_RATE_RPM', 30))       # requests / minute / key
+RATE_TPM        = float(os.environ.get('AMALLO_RATE_TPM', 20000))    # generated tokens / minute / key
+QUEUE_PER_KEY   = 16      # waiting requests per identity before 429
+QUEUE_TIMEOUT   = 300     # seconds a request may wait for a slot
+WORKERS_SPARE   = 2       # pool workers kept free for /health, /amallo/status and the like
+# A waiter, a running generation and an omni subscriber each pin a pool worker,
+# so queued waiters are capped at what the other two leave over.
+QUEUE_MAX       = max(1, WORKERS - OMNI_SUBSCRIBERS - INFER_SLOTS - WORKERS_SPARE)
+# Priority lanes, highest first. Interactive waiters are dispatched before any
+# batch one, and may preempt a running batch generation, which resumes later.
+LANES             = ('interactive', 'batch')
+LANE_BATCH_TOKENS = 1024   # max_tokens above this defaults to the batch lane
+
+class TokenBucket:
+    """`per_min` units per minute, bursting to one minute's worth. Generated
+    tokens are only known afterwards, so charge() may drive it into debt."""
+    def __init__(self, per_min):
+        self.rate  = per_min / 60.0
+        self.cap   = float(per_min)
+        self.level = self.cap
+        self.ts    = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.cap, self.level + (now - self.ts) * self.rate)
+        self.ts = now
+
+    def wait(self, n):
+        """Seconds until n units are available (0 = now)."""
+        self._refill()
+        return 0.0 if self.level >= n else (n - self.level) / self.rate
+
+    def charge(self, n):
+        self._refill()
+        self.level -= n
+
+class LatencyHistogram:
+    """Fixed buckets (ms); enough to compare lanes on /amallo/status."""
+    BOUNDS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.n = 0
+
+    def add(self, ms):
+        i = 0
+        while i < len(self.BOUNDS) and ms > self.BOUNDS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.n += 1
+
+    def pct(self, p):
+        """Upper bound of the bucket holding the p-th percentile."""
+        if not self.n:
+            return None
+        rank, seen = p / 100 * self.n, 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else f'>{self.BOUNDS[-1]}'
+
+    def status(self):
+        return {'n': self.n, 'p50_ms': self.pct(50), 'p95_ms': self.pct(95), 'p99_ms': self.pct(99),
+                'buckets': {f'le_{b}': c for b, c in zip(self.BOUNDS, self.counts)} | {'inf': self.counts[-1]}}
+
+class FairScheduler:
+    def __init__(self, slots=INFER_SLOTS):
+        self.slots    = slots
+        self.busy     = 0
+        self.vtime    = {lane: 0.0 for lane in LANES}
+        self.last_tag = {}      # (lane, identity) -> last virtual finish tag
+        self.waiting  = []      # heap of (lane rank, tag, seq, ticket)
+        self.running  = set()   # ids of tickets holding a slot
+        self.tickets  = {}      # id -> ticket, for running ones
+        self.seq      = 0
+        self.buckets  = {}      # identity -> (limits, [request bucket, token bucket])
+        self.service  = 10.0    # EWMA seconds a slot is held, for Retry-After
+        self.stats    = {'dispatched': 0, 'queued': 0, 'throttled': 0, 'timeouts': 0, 'preempted': 0,
+                         'queue_full': 0}
+        self.hists    = {lane: {k: LatencyHistogram() for k in ('wait', 'ttft', 'total')} for lane in LANES}
+        self.cond     = threading.Condition()
+
+    def _buckets(self, identity, rec):
+        limits = (rec.get('rpm', 0 if rec.get('role') == 'master' else RATE_RPM),
+                  rec.get('tpm', 0 if rec.get('role') == 'master' else RATE_TPM))
+        b = self.buckets.get(identity)
+        if b is None or b[0] != limits:
+            b = self.buckets[identity] = (limits, [TokenBucket(x) if x else None for x in limits])
+        return b[1]
+
+    def admit(self, identity, rec):
+        """Take one request from identity's bucket. Returns 0, or the number of
+        seconds until a retry would be admitted."""
+        with self.cond:
+            reqs, toks = self._buckets(identity, rec or {})
+            waits = [reqs.wait(1) if reqs else 0.0, toks.wait(0) if toks else 0.0]
+            queued = sum(1 for e in self.waiting if e[-1]['identity'] == identity)
+            if queued >= QUEUE_PER_KEY:
+                waits.append(self.service * (queued + 1) / self.slots)
+            if len(self.waiting) >= QUEUE_MAX:
+                waits.append(self.service * (len(self.waiting) + 1) / self.slots)
+            wait = max(waits)
+            if wait > 0:
+                self.stats['throttled'] += 1
+                return wait
+            if reqs: reqs.charge(1)
+            return 0.0
+
+    def acquire(self, identity, weight=1, lane='interactive', timeout=QUEUE_TIMEOUT):
+        """Block until a slot is ours. Returns a ticket carrying 'position'
+        (waiters ahead at enqueue, 0 = dispatched at once) and 'wait_ms',
+        or None on timeout or when QUEUE_MAX are already waiting. Lanes are
+        served in strict priority order."""
+        with self.cond:
+            if len(self.waiting) >= QUEUE_MAX:
+                self.stats['queue_full'] += 1
+                return None
+            vt = self.vtime[lane]
+            tag = max(vt, self.last_tag.get((lane, identity), 0.0)) + 1.0 / max(weight, 0.01)
+            self.last_tag[(lane, identity)] = tag
+            self.seq += 1
+            ticket = {'id': self.seq, 'identity': identity, 'lane': lane, 'tag': tag,
+                      't0': time.monotonic(), 'position': 0, 'preemptions': 0,
+                      'preempt': threading.Event()}
+            return self._wait(ticket, timeout)
+
+    def _wait(self, ticket, timeout):
+        entry = (LANES.index(ticket['lane']), ticket['tag'], ticket['id'], ticket)
+        if self.busy < self.slots and not self.waiting:
+            return self._dispatch(ticket)
+        ticket['position'] = 1 + sum(1 for e in self.waiting if e[:3] < entry[:3])
+        heapq.heappush(self.waiting, entry)
+        self.stats['queued'] += 1
+        self._preempt_for(ticket)
+        deadline = time.monotonic() + timeout
+        while not (self.waiting[0] is entry and self.busy < self.slots):
+            left = deadline - time.monotonic()
+            if left <= 0:
+                self.waiting.remove(entry); heapq.heapify(self.waiting)
+                self.stats['timeouts'] += 1
+                self.cond.notify_all()
+                return None
+            self.cond.wait(left)
+        heapq.heappop(self.waiting)
+        self.cond.notify_all()   # the next in line may fit another free slot
+        return self._dispatch(ticket)
+
+    def _preempt_for(self, ticket):
+        """An interactive waiter with every slot busy asks the youngest running
+        preemptible batch generation to step aside."""
+        if ticket['lane'] != 'interactive' or self.busy < self.slots:
+            return
+        waiting = sum(1 for e in self.waiting if e[-1]['lane'] == 'interactive')
+        stepping = sum(1 for t in self.tickets.values() if t['preempt'].is_set())
+        victims = [t for t in self.tickets.values() if t['lane'] != 'interactive'
+                   and t.get('preemptible') and not t['preempt'].is_set()]
+        if victims and waiting > stepping:
+            max(victims, key=lambda t: t['start'])['preempt'].set()
+
+    def _dispatch(self, ticket):
+        self.busy += 1
+        self.vtime[ticket['lane']] = max(self.vtime[ticket['lane']], ticket['tag'])
+        ticket['start'] = time.monotonic()
+        if 'wait_ms' not in ticket:
+            ticket['wait_ms'] = round((ticket['start'] - ticket['t0']) * 1000)
+            self.hists[ticket['lane']]['wait'].add(ticket['wait_ms'])
+        self.tickets[ticket['id']] = ticket
+        self.stats['dispatched'] += 1
+        return ticket
+
+    def _free(self, ticket):
+        self.busy -= 1
+        self.tickets.pop(ticket['id'], None)
+        self.service = 0.8 * self.service + 0.2 * (time.monotonic() - ticket['start'])
+
+    def release(self, ticket, tokens=0):
+        with self.cond:
+            self._free(ticket)
+            self.hists[ticket['lane']]['total'].add((time.monotonic() - ticket['t0']) * 1000)
+            b = self.buckets.get(ticket['identity'])
+            if b and b[1][1] and tokens:
+                b[1][1].charge(tokens)
+            if not self.waiting:
+                self.last_tag = {k: t for k, t in self.last_tag.items() if t > self.vtime[k[0]]}
+            self.cond.notify_all()
+
+    def abandon(self, ticket):
+        """Release a ticket whose hold() never started: the request died
+        before the first event. Once hold() runs, its finally owns the slot."""
+        with self.cond:
+            if not ticket.get('held') and ticket['id'] in self.tickets:
+                self.release(ticket)
+
+    def step_aside(self, ticket, timeout=QUEUE_TIMEOUT):
+        """Give a preempted ticket's slot away and queue it again, ahead of the
+        rest of its lane (it keeps its tag). Returns False on timeout."""
+        with self.cond:
+            self._free(ticket)
+            ticket['preempt'].clear()
+            ticket['preemptions'] += 1
+            self.stats['preempted'] += 1
+            self.cond.notify_all()
+            return self._wait(ticket, timeout) is not None
+
+    def hold(self, ticket, events, identity=None, weight=1, lane='interactive'):
+        """Pass events through, releasing the slot and charging generated
+        tokens to the identity when the generation ends. Without a ticket the
+        slot is acquired on first iteration (on the single-flight thread)."""
+        if ticket is None:
+            ticket = self.acquire(identity, weight, lane)
+            if ticket is None:
+                if not callable(events): events.close()
+                yield {'type': 'error', 'error': 'inference queue timeout'}
+                return
+        ticket['held'] = True
+        if callable(events):
+            events = events(ticket)   # a preemptible source wants to see its ticket
+        tokens, first = 0, True
+        try:
+            for ev in events:
+                if ev['type'] == 'token':
+                    tokens += len(ev['text']) // 4 + 1
+                    if first:
+                        first = False
+                        with self.cond:
+                            self.hists[ticket['lane']]['ttft'].add((time.monotonic() - ticket['t0']) * 1000)
+                elif ev['type'] == 'done':
+                    tokens = ev.get('stats', {}).get('eval_count', tokens)
+                yield ev
+        finally:
+            events.close()
+            if ticket['id'] in self.tickets:
+                self.release(ticket, tokens)
+
+    def status(self):
+        with self.cond:
+            per_key = {}
+            for e in self.waiting:
+                per_key[e[-1]['identity']] = per_key.get(e[-1]['identity'], 0) + 1
+            return dict(self.stats, slots=self.slots, busy=self.busy, waiting=len(self.waiting),
+                        queue_max=QUEUE_MAX, waiting_by_identity=per_key,
+                        service_s=round(self.service, 2),
+                        lanes={lane: {k: h.status() for k, h in hs.items()}
+                               for lane, hs in self.hists.items()})
+
+def classify_lane(headers, rec, body):
+    """X-Amallo-Lane header, else the key's 'lane', else long generations are batch."""
+    lane = (headers.get('X-Amallo-Lane') or (rec or {}).get('lane') or '').lower()
+    if lane in LANES:
+        return lane
+    return 'batch' if int(body.get('max_tokens') or 0) > LANE_BATCH_TOKENS else 'interactive'
+
+def resumable_events(model_name, messages, max_tokens, temperature, route_key):
+    """Source for batch-lane generations: always streams from upstream, so it
+    can be interrupted at a token boundary. When its ticket is preempted it
+    closes the upstream (Ollama aborts), queues again, and resumes by sending
+    the partial reply back as a trailing assistant message to continue from."""
+    def run(ticket):
+        ticket['preemptible'] = True
+        produced, budget = [], max_tokens
+        while True:
+            msgs = messages + [{'role': 'assistant', 'content': ''.join(produced)}] if produced else messages
+            src = run_inference_stream(model_name, msgs, budget, temperature, route_key=route_key)
+            try:
+                for ev in src:
+                    if ev['type'] == 'token':
+                        produced.append(ev['text']); budget -= 1
+                    yield ev
+                    if ev['type'] != 'token' or not ticket['preempt'].is_set() or budget <= 0:
+                        continue
+                    break
+                else:
+                    return
+            finally:
+                src.close()
+            if not scheduler.step_aside(ticket):
+                yield {'type': 'error', 'error': 'inference queue timeout after preemption'}
+                return
+    return run
+
+scheduler = FairScheduler()
+
+# ── USAGE ACCOUNTING ──────────────────────────────────────────────────────────
+# Per (minute, identity, model) cells: request/error/token/byte counters and
+# HDR-style TTFT and total-latency histograms. The last USAGE_MEMORY_MIN
+# minutes live in memory; every USAGE_FLUSH_S the touched cells are upserted
+# into SQLite, so /amallo/stats can answer any window up to USAGE_RETAIN_D.
+USAGE_DB         = os.environ.get('AMALLO_USAGE_DB', '/root/amallo/usage.db')
+USAGE_FLUSH_S    = 30
+USAGE_MEMORY_MIN = 60
+USAGE_RETAIN_D   = 30
+
+class HdrHistogram:
+    """Log-linear buckets: exact below 16ms, then 16 linear sub-buckets per
+    power of two (<= 6.25% relative error) up to 2^28 ms. At most 400
+    counters, kept sparse; histograms merge by adding counts."""
+    SUB, MAX = 16, (1 << 28) - 1
+
+    def __init__(self, counts=None):
+        self.counts = counts or {}
+
+    @classmethod
+    def index(cls, v):
+        v = min(max(int(v), 0), cls.MAX)
+        if v < cls.SUB:
+            return v
+        shift = v.bit_length() - 5
+        return cls.SUB + shift * cls.SUB + (v >> shift) - cls.SUB
+
+    @classmethod
+    def value(cls, i):
+        """Upper edge of bucket i."""
+        if i < cls.SUB:
+            return i
+        shift, m = divmod(i - cls.SUB, cls.SUB)
+        return ((cls.SUB + m + 1) << shift) - 1
+
+    def add(self, ms):
+        i = self.index(ms)
+        self.counts[i] = self.counts.get(i, 0) + 1
+
+    def merge(self, other):
+        for i, c in other.counts.items():
+            self.counts[i] = self.counts.get(i, 0) + c
+        return self
+
+    def percentiles(self, ps=(50, 90, 99)):
+        n = sum(self.counts.values())
+        if not n:
+            return None
+        out, seen, order = {}, 0, sorted(self.counts.items())
+        targets = iter(sorted(ps)); p = next(targets)
+        for i, c in order:
+            seen += c
+            while p is not None and seen >= p / 100 * n:
+                out[f'p{p}'] = self.value(i)
+                p = next(targets, None)
+        out['max'] = self.value(order[-1][0])
+        out['n'] = n
+        return out
+
+    def dumps(self):
+        return json.dumps(self.counts, separators=(',', ':'))
+
+    @classmethod
+    def loads(cls, text):
+        return cls({int(k): v for k, v in json.loads(text or '{}').items()})
+
+USAGE_FIELDS = ('requests', 'errors', 'rejected', 'deduped', 'prompt_tokens', 'completion_tokens', 'bytes')
+
+class UsageAccounting:
+    def __init__(self, path=USAGE_DB):
+        self.path  = path
+        self.cells = {}      # (minute, identity, model) -> cell
+        self.dirty = set()
+        self.lock  = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._db() as db:
+            db.execute('''CREATE TABLE IF NOT EXISTS usage_minute (
+                minute INTEGER, identity TEXT, model TEXT,
+                requests INTEGER, errors INTEGER, rejected INTEGER, deduped INTEGER,
+                prompt_tokens INTEGER, completion_tokens INTEGER, bytes INTEGER,
+                ttft TEXT, total TEXT, PRIMARY KEY (minute, identity, model))''')
+        threading.Thread(target=self._flusher, daemon=True).start()
+        atexit.register(self.flush)
+
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+    @staticmethod
+    def _cell():
+        return dict({f: 0 for f in USAGE_FIELDS}, ttft=HdrHistogram(), total=HdrHistogram())
+
+    def record(self, identity, model, ttft_ms=None, total_ms=None, prompt_tokens=0,
+               completion_tokens=0, nbytes=0, error=False, rejected=False, deduped=False):
+        key = (int(time.time() // 60), identity or '-', model or '-')
+        with self.lock:
+            c = self.cells.get(key)
+            if c is None:
+                c = self.cells[key] = self._cell()
+            c['requests'] += 1
+            c['errors'] += bool(error)
+            c['rejected'] += bool(rejected)
+            c['deduped'] += bool(deduped)
+            c['prompt_tokens'] += prompt_tokens or 0
+            c['completion_tokens'] += completion_tokens or 0
+            c['bytes'] += nbytes or 0
+            if ttft_ms is not None: c['ttft'].add(ttft_ms)
+            if total_ms is not None: c['total'].add(total_ms)
+            self.dirty.add(key)
+
+    def flush(self):
+        with self.lock:
+            rows = [(*k, *(self.cells[k][f] for f in USAGE_FIELDS),
+                     self.cells[k]['ttft'].dumps(), self.cells[k]['total'].dumps())
+                    for k in self.dirty]
+            self.dirty.clear()
+            horizon = int(time.time() // 60) - USAGE_MEMORY_MIN
+            for k in [k for k in self.cells if k[0] < horizon]:
+                del self.cells[k]
+        if not rows:
+            return
+        with self._db() as db:   # whole-minute upserts: re-flushing a cell is idempotent
+            db.executemany('INSERT OR REPLACE INTO usage_minute VALUES (?,?,?,?,?,?,?,?,?,?,?,?)', rows)
+            db.execute('DELETE FROM usage_minute WHERE minute < ?',
+                       (int(time.time() // 60) - USAGE_RETAIN_D * 1440,))
+
+    def _flusher(self):
+        while True:
+            time.sleep(USAGE_FLUSH_S)
+            try: self.flush()
+            except sqlite3.Error as e: print(f'[AMALLO] usage flush failed: {e}')
+
+    def query(self, window_s=3600, identity=None, model=None, group=('identity', 'model')):
+        """Aggregate cells from the last window_s seconds, grouped by any of
+        identity/model. Recent minutes come from memory, older ones from SQLite."""
+        since = int((time.time() - window_s) // 60)
+        with self.lock:
+            mem = {k: dict(v, ttft=HdrHistogram(dict(v['ttft'].counts)),
+                           total=HdrHistogram(dict(v['total'].counts)))
+                   for k, v in self.cells.items() if k[0] >= since}
+            # same snapshot as mem: minutes still in memory are never read from SQLite too
+            oldest = min((k[0] for k in self.cells), default=int(time.time() // 60) + 1)
+        sql, args = 'SELECT * FROM usage_minute WHERE minute >= ? AND minute < ?', [since, oldest]
+        if identity: sql += ' AND identity = ?'; args.append(identity)
+        if model:    sql += ' AND model = ?';    args.append(model)
+        with self._db() as db:
+            rows = db.execute(sql, args).fetchall()
+        cells = [((r[0], r[1], r[2]), dict(zip(USAGE_FIELDS, r[3:10]), ttft=HdrHistogram.loads(r[10]),
+                                           total=HdrHistogram.loads(r[11]))) for r in rows]
+        cells += [(k, v) for k, v in mem.items()
+                  if (not identity or k[1] == identity) and (not model or k[2] == model)]
+        groups = {}
+        for (minute, ident, mod), c in cells:
+            gk = tuple(v for name, v in (('identity', ident), ('model', mod)) if name in group)
+            g = groups.get(gk)
+            if g is None:
+                g = groups[gk] = self._cell()
+            for f in USAGE_FIELDS:
+                g[f] += c[f]
+            g['ttft'].merge(c['ttft']); g['total'].merge(c['total'])
+        out = []
+        for gk, g in groups.items():
+            row = dict(zip([n for n in ('identity', 'model') if n in group], gk))
+            row.update({f: g[f] for f in USAGE_FIELDS})
+            row['ttft_ms'], row['total_ms'] = g['ttft'].percentiles(), g['total'].percentiles()
+            out.append(row)
+        return sorted(out, key=lambda r: (r['completion_tokens'], r['requests']), reverse=True)
+
+usage = UsageAccounting()
+
+def parse_window(text, default=3600):
+    """'90s', '15m', '6h', '7d' -> seconds."""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
     try:
-        stdin, stdout, _ = client.exec_command(
-            "curl -s -X POST http://localhost:11434/api/generate "
-            "-H 'Content-Type: application/json' -d @-", timeout=120)
-        stdin.write(payload.encode()); stdin.channel.shutdown_write()
-        out = stdout.read().decode('utf-8', errors='replace').strip()
-        if out:
-            result = json.loads(out).get('response', '')
-            if result: return result, 'ollama@remote'
+        return int(float(text[:-1]) * units[text[-1]]) if text and text[-1] in units else int(text or default)
+    except ValueError:
+        return default
+
+# ── MODEL WARMING ─────────────────────────────────────────────────────────────
+# Learns per-model demand by hour of day and by what tends to follow the last
+# model asked for, from the usage log and live traffic. While the node is idle
+# it preloads the likely-next models into Ollama (empty generate + keep_alive)
+# within WARM_BUDGET_GB, and unloads loaded models that are neither predicted
+# nor recently used. tools/warm-eval.py replays a request log through the same
+# DemandModel to measure cold starts avoided.
+WARM_ENABLED      = os.environ.get('AMALLO_WARM', '1') != '0'
+WARM_BUDGET_GB    = float(os.environ.get('AMALLO_WARM_BUDGET_GB', 20))
+WARM_EVERY        = 60       # seconds between warming passes
+WARM_IDLE_S       = 5        # only act once no inference has run for this long
+WARM_LOOKAHEAD    = 900      # predict demand over the next 15 minutes
+WARM_MIN_SCORE    = 0.15     # below this a model is not worth preloading
+WARM_UNLOAD_IDLE  = 600      # unpredicted models unused this long are unloaded
+SEQ_WINDOW        = 1800     # a request follows the previous one if within this
+DEMAND_HALF_LIFE  = 7 * 86400
+COLD_LOAD_NS      = 500_000_000   # Ollama load_duration above this = cold start
+
+def ollama_tag(name):
+    return name if ':' in name else name + ':latest'
+
+class DemandModel:
+    """Hour-of-day demand shares plus first-order model-to-model transitions,
+    both exponentially decayed. Pure bookkeeping; no I/O."""
+    def __init__(self, half_life=DEMAND_HALF_LIFE):
+        self.half_life = half_life
+        self.hourly  = {}      # hour -> {model: weight}
+        self.trans   = {}      # previous model -> {next model: weight}
+        self.last, self.last_ts = None, 0
+        self.decay_ts = None
+
+    def _decay(self, ts):
+        if self.decay_ts is None:
+            self.decay_ts = ts
+        elif ts - self.decay_ts >= self.half_life:
+            for table in (self.hourly, self.trans):
+                for row in table.values():
+                    for m in row: row[m] /= 2
+            self.decay_ts = ts
+
+    def observe(self, ts, model, n=1):
+        self._decay(ts)
+        row = self.hourly.setdefault(time.localtime(ts).tm_hour, {})
+        row[model] = row.get(model, 0) + n
+        if self.last and ts - self.last_ts < SEQ_WINDOW:
+            row = self.trans.setdefault(self.last, {})
+            row[model] = row.get(model, 0) + n
+        self.last, self.last_ts = model, ts
+
+    def scores(self, ts, lookahead=WARM_LOOKAHEAD):
+        """{model: score in [0, 1]}: mean of the hourly share over the coming
+        window and, if the last request was recent, the transition share."""
+        hours = {time.localtime(ts).tm_hour, time.localtime(ts + lookahead).tm_hour}
+        hourly = {}
+        for h in hours:
+            row = self.hourly.get(h, {})
+            total = sum(row.values())
+            for m, w in row.items():
+                hourly[m] = max(hourly.get(m, 0), w / total)
+        seq = {}
+        if self.last and ts - self.last_ts < SEQ_WINDOW:
+            row = self.trans.get(self.last, {self.last: 1})
+            total = sum(row.values())
+            seq = {m: w / total for m, w in row.items()}
+        return {m: (hourly.get(m, 0) + seq.get(m, 0)) / 2 for m in set(hourly) | set(seq)}
+
+    def plan(self, ts, sizes, budget, min_score=WARM_MIN_SCORE):
+        """Models worth keeping resident, best first, whose sizes fit budget."""
+        picked, used = [], 0
+        for m, score in sorted(self.scores(ts).items(), key=lambda kv: -kv[1]):
+            if score < min_score:
+                break
+            size = sizes.get(m)
+            if size is None or used + size > budget:
+                continue
+            picked.append(m); used += size
+        return picked
+
+class ModelWarmer:
+    def __init__(self):
+        self.demand  = DemandModel()
+        self.used    = {}      # model -> last request (epoch)
+        self.plan    = []
+        self.loaded  = []
+        self.stats   = {'preloads': 0, 'unloads': 0, 'cold_starts': 0, 'warm_hits': 0,
+                        'last_error': None}
+        self.lock    = threading.Lock()
+        try:
+            self.seed(USAGE_DB)
+        except sqlite3.Error as e:
+            self.stats['last_error'] = f'seed: {e}'
+        if WARM_ENABLED:
+            threading.Thread(target=self._loop, daemon=True).start()
+
+    def seed(self, path):
+        """Replay per-minute request counts from the usage log."""
+        if not os.path.exists(path):
+            return
+        db = sqlite3.connect(path, timeout=10)
+        try:
+            rows = db.execute('SELECT minute, model, SUM(requests) FROM usage_minute '
+                              'WHERE rejected < requests GROUP BY minute, model ORDER BY minute').fetchall()
+        finally:
+            db.close()
+        with self.lock:
+            for minute, model, n in rows:
+                self.demand.observe(minute * 60, ollama_tag(model), n)
+
+    def observe(self, model, stats=None):
+        model = ollama_tag(model)
+        with self.lock:
+            self.demand.observe(time.time(), model)
+            self.used[model] = time.time()
+            if stats and 'load_duration' in stats:
+                key = 'cold_starts' if stats['load_duration'] > COLD_LOAD_NS else 'warm_hits'
+                self.stats[key] += 1
+
+    def _ollama(self, path, payload=None):
+        up = UPSTREAMS['ollama']
+        return up.request('POST' if payload is not None else 'GET', path, payload, timeout=300)[1]
+
+    def tick(self):
+        status, ps = UPSTREAMS['ollama'].request('GET', '/api/ps', timeout=300)
+        if status != 200:
+            # no /api/ps (gguf_server): what is resident is unknown and keep_alive
+            # isn't honoured, so preloads/unloads would be blind; stand down
+            self.stats['last_error'] = f'/api/ps returned {status}; warmer unsupported by upstream'
+            return
+        sizes  = {m['name']: m.get('size', 0) for m in self._ollama('/api/tags').get('models', [])}
+        loaded = [m['name'] for m in ps.get('models', [])]
+        now = time.time()
+        with self.lock:
+            plan = self.demand.plan(now, sizes, WARM_BUDGET_GB * 1e9)
+            self.plan, self.loaded = plan, loaded
+            idle = [m for m in loaded if m not in plan and now - self.used.get(m, 0) > WARM_UNLOAD_IDLE]
+        for m in idle:
+            if router.idle_for() < WARM_IDLE_S: return
+            self._ollama('/api/generate', {'model': m, 'keep_alive': 0})
+            self.stats['unloads'] += 1
+        for m in plan:
+            if m in loaded: continue
+            if router.idle_for() < WARM_IDLE_S: return
+            self._ollama('/api/generate', {'model': m, 'keep_alive': OLLAMA_KEEP_ALIVE})
+            self.stats['preloads'] += 1
+
+    def _loop(self):
+        while True:
+            time.sleep(WARM_EVERY)
+            if router.idle_for() < WARM_IDLE_S or UPSTREAMS['ollama'].state == 'open':
+                continue
+            try:
+                self.tick()
+            except Exception as e:
+                self.stats['last_error'] = str(e)
+
+    def status(self):
+        with self.lock:
+            return dict(self.stats, enabled=WARM_ENABLED, budget_gb=WARM_BUDGET_GB,
+                        plan=self.plan, loaded=self.loaded,
+                        scores={m: round(v, 3) for m, v in sorted(
+                            self.demand.scores(time.time()).items(), key=lambda kv: -kv[1])[:8]})
+
+warmer = ModelWarmer()
+
+def run_inference_ssh(sess, messages, model, max_tokens, temperature, info=None):
+    """Non-streaming remote inference over the session's tunnels. Returns (text, backend)."""
+    try:
+        _, d = sess['ollama'].request('POST', '/api/chat', chat_payload(
+            model, messages, max_tokens, temperature, False), timeout=300, info=info)
+        result = d.get('message', {}).get('content', '')
+        if result: return result, 'ollama@remote'
     except: pass
 
-    amallo_payload = json.dumps({'model': model, 'messages': messages})
     try:
-        stdin2, stdout2, _ = client.exec_command(
-            "curl -s -X POST http://localhost:8200/v1/chat/completions "
-            "-H 'Content-Type: application/json' -H 'Authorization: Bearer local' -d @-",
-            timeout=120)
-        stdin2.write(amallo_payload.encode()); stdin2.channel.shutdown_write()
-        out2 = stdout2.read().decode('utf-8', errors='replace').strip()
-        if out2:
-            d2 = json.loads(out2)
-            result2 = d2.get('choices', [{}])[0].get('message', {}).get('content', '')
-            if result2: return result2, 'amallo@remote'
+        _, d2 = sess['amallo'].request('POST', '/v1/chat/completions',
+                                       {'model': model, 'messages': messages}, timeout=300,
+                                       headers={'Authorization': 'Bearer local'}, info=info)
+        result2 = d2.get('choices', [{}])[0].get('message', {}).get('content', '')
+        if result2: return result2, 'amallo@remote'
     except: pass
 
     return None, None
 
-keys   = KeyManager()
+keys   = KeyStore(KEYS_FILE, new_key=sov_token)
 models = ModelManager()
 
 # ── SHARED MEMORY ─────────────────────────────────────────────────────────────
 # One brain. Every interface (CLI, SMS, IDE, CLANK) reads/writes same context.
-# Keyed by identity (default: 'marcus'). Persisted to disk on every write.
-import pathlib
-MEMORY_DIR = pathlib.Path('/root/.local/share/amallo/memory')
+# Keyed by identity (default: 'marcus'). Each identity is an append-only
+# <identity>.jsonl log on disk plus an in-process ring buffer of the recent
+# window, so injection and /amallo/memory reads never touch the disk.
+# A longer archive behind the window is searchable, and a background pass
+# folds older turns into a running summary. Shallow requests get the summary,
+# the few archived messages most similar to the new turn and the last two
+# turns, all within MEMORY_TOKENS.
+import pathlib, fcntl, re, zlib
+MEMORY_DIR       = pathlib.Path('/root/.local/share/amallo/memory')
 MEMORY_DIR.mkdir(parents=True, exist_ok=True)
-
-def _mem_path(identity='marcus'):
-    safe = ''.join(c for c in identity if c.isalnum() or c in '-_')
-    return MEMORY_DIR / f'{safe}.json'
+MEMORY_WINDOW    = 40     # messages kept per identity
+MEMORY_ARCHIVE   = int(os.environ.get('AMALLO_MEMORY_ARCHIVE', 1000))   # messages searchable per identity
+MEMORY_COMPACT_S = 300    # seconds between compaction sweeps
+MEMORY_TOKENS    = int(os.environ.get('AMALLO_MEMORY_TOKENS', 900))   # injected memory ceiling (est. tokens)
+RECALL_K         = 6      # most relevant archived messages injected
+RECALL_MIN_SCORE = 0.08   # cosine floor; below this a snippet is noise
+RECALL_TAIL      = 4      # last two turns always come along verbatim
+# Rolling summary: a small local model folds older turns in while the node is idle
+SUMMARY_MODEL    = os.environ.get('AMALLO_SUMMARY_MODEL', 'llama3.2')
+SUMMARY_TOKENS   = 300    # summary length cap (num_predict)
+SUMMARY_BATCH    = 12     # fold once this many turns are waiting behind the tail
+SUMMARY_IDLE_S   = 20     # ...and no inference has run for this long
+SUMMARY_EVERY    = 15     # seconds between summarizer checks
+# Ollama embedding model (e.g. nomic-embed-text); unset or unreachable -> hashed n-grams
+EMBED_MODEL      = os.environ.get('AMALLO_EMBED_MODEL', '')
+EMBED_DIM        = 1024   # hashed n-gram buckets
+
+_WORD = re.compile(r"[a-z0-9']+")
+_STOP = set('a an and are as at be but by can do for from had has have he her his how i if in '
+            'into is it its me my no not of on or our she so than that the their them then there '
+            'they this to up was we were what when where which who why will with you your'.split())
+
+def hash_embed(text):
+    """Offline embedding: signed feature hashing of content words, word bigrams
+    and (at half weight) character trigrams into EMBED_DIM buckets.
+    Sparse {bucket: weight}, L2 = 1."""
+    words = [w for w in _WORD.findall(text.lower()) if w not in _STOP]
+    feats = [(w, 1.0) for w in words] + [(a + ' ' + b, 1.0) for a, b in zip(words, words[1:])]
+    for w in words:
+        w = f'#{w}#'
+        feats += [(w[i:i + 3], 0.5) for i in range(len(w) - 2)]
+    vec = {}
+    for f, weight in feats:
+        h = zlib.crc32(f.encode())
+        b = h % EMBED_DIM
+        vec[b] = vec.get(b, 0.0) + (weight if h & 0x80000000 else -weight)
+    norm = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+    return {b: v / norm for b, v in vec.items() if v}
+
+def _cosine(a, b):
+    if isinstance(a, dict):
+        if len(a) > len(b): a, b = b, a
+        return sum(v * b.get(k, 0.0) for k, v in a.items())
+    return sum(x * y for x, y in zip(a, b))
+
+def embed(texts):
+    """Return (embedder name, vectors). Uses EMBED_MODEL via Ollama /api/embed
+    when configured and reachable, hashed n-grams otherwise."""
+    if EMBED_MODEL and UPSTREAMS['ollama'].state != 'open':
+        try:
+            _, d = UPSTREAMS['ollama'].request('POST', '/api/embed',
+                                               {'model': EMBED_MODEL, 'input': texts}, timeout=30)
+            vecs = []
+            for v in d.get('embeddings', []):
+                norm = math.sqrt(sum(x * x for x in v)) or 1.0
+                vecs.append([x / norm for x in v])
+            if len(vecs) == len(texts):
+                return EMBED_MODEL, vecs
+        except Exception:
+            pass
+    return 'hash', [hash_embed(t) for t in texts]
+
+def est_tokens(text):
+    return len(text) // 4 + 4
+
+class MemoryStore:
+    """Log records are {"op": "append"|"replace"|"clear", ...}; replaying them in
+    order rebuilds the window. Writes hold a per-identity thread lock plus an
+    flock on the log, so concurrent writers land in one total order, and a
+    record is on disk before it is visible in the ring buffer."""
+
+    def __init__(self, root=MEMORY_DIR, window=MEMORY_WINDOW, archive=MEMORY_ARCHIVE):
+        self.root, self.window, self.archive = root, window, max(archive, window)
+        self.mems  = {}   # identity -> {'ring', 'archive', 'vecs', 'summary', 'pending', 'lock', ...}
+        self.guard = threading.Lock()
+        threading.Thread(target=self._compactor, daemon=True).start()
+
+    def _path(self, identity, ext='.jsonl'):
+        safe = ''.join(c for c in identity if c.isalnum() or c in '-_')
+        return self.root / f'{safe}{ext}'
+
+    def _mem(self, identity):
+        with self.guard:
+            mem = self.mems.get(identity)
+            if mem is None:
+                mem = {'ring': deque(maxlen=self.window), 'archive': deque(maxlen=self.archive),
+                       'vecs': {}, 'summary': '', 'pending': 0, 'gen': 0,
+                       'lock': threading.Lock(), 'records': 0, 'ts': 0, 'model': 'dolphin-mistral:latest', 'loaded': False}
+                self.mems[identity] = mem
+        if not mem['loaded']:
+            with mem['lock']:
+                if not mem['loaded']:
+                    self._replay(identity, mem)
+                    mem['loaded'] = True
+        return mem
+
+    def _replay(self, identity, mem):
+        log, legacy = self._path(identity), self._path(identity, '.json')
+        if not log.exists() and legacy.exists():
+            # one-time migration from the old whole-file JSON format
+            try:
+                old = json.loads(legacy.read_text())
+                mem['model'] = old.get('model', mem['model'])
+                self._write(log, [{'op': 'replace', 'messages': old.get('messages', []),
+                                   'ts': old.get('ts', 0)}], mode='w')
+            except (OSError, ValueError):
+                pass
+        if not log.exists():
+            return
+        with open(log) as f:
+            for line in f:
+                try: rec = json.loads(line)
+                except ValueError: continue   # torn final line from a crash
+                self._apply(mem, rec)
+                mem['records'] += 1
+
+    @staticmethod
+    def _apply(mem, rec):
+        op = rec.get('op')
+        if op == 'append':
+            msg = {'role': rec['role'], 'content': rec['content'], 'ts': rec['ts']}
+            mem['ring'].append(msg)
+            mem['archive'].append(msg)
+            mem['pending'] += 1
+        elif op == 'replace':
+            # compaction writes the whole archive; the ring keeps its tail
+            for q in (mem['ring'], mem['archive']):
+                q.clear()
+                q.extend(rec.get('messages', []))
+            mem['summary'] = rec.get('summary', '')
+            mem['pending'] = rec.get('pending', len(rec.get('messages', [])))
+            mem['gen'] += 1
+        elif op == 'clear':
+            mem['ring'].clear()
+            mem['archive'].clear()
+            mem['vecs'].clear()
+            mem['summary'], mem['pending'] = '', 0
+            mem['gen'] += 1
+        elif op == 'summary':
+            # the oldest `folded` unsummarized messages are now in the summary
+            mem['summary'] = rec.get('text', '')
+            mem['pending'] = max(mem['pending'] - rec.get('folded', 0), 0)
+        # the archive is bounded: messages it drops can't be waiting for the summary
+        mem['pending'] = min(mem['pending'], len(mem['archive']))
+        mem['ts'] = rec.get('ts', mem['ts'])
+
+    @staticmethod
+    def _write(path, records, mode='a'):
+        data = ''.join(json.dumps(r) + '\n' for r in records)
+        while True:
+            with open(path, mode) as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+                        continue   # compacted under us; append to the new log instead
+                    f.write(data); f.flush()
+                    return
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _record(self, identity, rec):
+        mem = self._mem(identity)
+        with mem['lock']:
+            self._write(self._path(identity), [rec])
+            self._apply(mem, rec)
+            mem['records'] += 1
+            return len(mem['ring'])
+
+    # ── API ──────────────────────────────────────────────────────
+    def append(self, role, content, identity='marcus'):
+        return self._record(identity, {'op': 'append', 'role': role, 'content': content,
+                                       'ts': int(time.time())})
+
+    def replace(self, messages, identity='marcus'):
+        return self._record(identity, {'op': 'replace', 'messages': messages[-self.window:],
+                                       'ts': int(time.time())})
+
+    def clear(self, identity='marcus'):
+        return self._record(identity, {'op': 'clear', 'ts': int(time.time())})
+
+    def recent(self, identity='marcus', n=None):
+        mem = self._mem(identity)
+        with mem['lock']:
+            msgs = list(mem['ring'])
+        return msgs[-n:] if n else msgs
+
+    def recall(self, identity, query, exclude=(), k=RECALL_K, budget=MEMORY_TOKENS,
+               tail=RECALL_TAIL):
+        """Return (summary, snippets, tail) within budget tokens: the rolling
+        summary, up to k archived messages most similar to query (in
+        chronological order) and the last `tail` messages, newest kept first.
+        Contents in `exclude` are skipped."""
+        mem = self._mem(identity)
+        with mem['lock']:
+            archive = list(mem['archive'])
+            summary = mem['summary']
+            cache   = mem['vecs']
+        spent  = est_tokens(summary) if summary else 0
+        split  = max(len(archive) - tail, 0)
+        recent = []
+        for m in reversed(archive[split:]):
+            if m.get('content') in exclude:
+                continue
+            cost = est_tokens(m['content'])
+            if spent + cost > budget:
+                if not recent:   # never drop the last turn entirely; clip it instead
+                    recent.append(dict(m, content=m['content'][-max(budget - spent, 64) * 4:]))
+                break
+            recent.append(m); spent += cost
+        recent.reverse()
+        older  = list({m['content']: m for m in archive[:split]   # repeats: keep the latest
+                       if m.get('content') and m['content'] not in exclude}.values())
+        if not older or not query.strip() or spent >= budget:
+            return summary, [], recent
+        name, (qvec,) = embed([query])
+        missing = list({m['content'] for m in older if (name, m['content']) not in cache})
+        if missing:
+            got, vecs = embed(missing)
+            if got != name:   # embedder fell over mid-way; score everything hashed
+                name, (qvec,) = 'hash', [hash_embed(query)]
+                missing = [c for c in {m['content'] for m in older} if ('hash', c) not in cache]
+                vecs = [hash_embed(c) for c in missing]
+            with mem['lock']:
+                if len(cache) > 2 * self.archive:
+                    cache.clear()
+                cache.update(((name, c), v) for c, v in zip(missing, vecs))
+        scored = sorted(((_cosine(qvec, cache[(name, m['content'])]), i) for i, m in enumerate(older)
+                         if (name, m['content']) in cache), reverse=True)
+        picked = []
+        for score, i in scored:
+            if score < RECALL_MIN_SCORE or len(picked) >= k:
+                break
+            cost = est_tokens(older[i]['content'])
+            if spent + cost <= budget:
+                picked.append(i); spent += cost
+        return summary, [older[i] for i in sorted(picked)], recent
+
+    # ── rolling summary ──────────────────────────────────────────
+    def summary_work(self, identity, tail=RECALL_TAIL, batch=SUMMARY_BATCH):
+        """(gen, summary, messages) to fold for identity, or None if fewer than
+        `batch` unsummarized messages sit behind the tail."""
+        mem = self._mem(identity)
+        with mem['lock']:
+            archive = list(mem['archive'])
+            pending = mem['pending']
+            due = pending - tail
+            if due < batch:
+                return None
+            return mem['gen'], mem['summary'], archive[len(archive) - pending:][:due]
+
+    def fold(self, identity, gen, text, folded):
+        """Record a new summary covering `folded` more messages, unless the
+        memory was cleared or replaced while it was being written."""
+        mem = self._mem(identity)
+        with mem['lock']:
+            if mem['gen'] != gen:
+                return False
+            rec = {'op': 'summary', 'text': text, 'folded': folded, 'ts': int(time.time())}
+            self._write(self._path(identity), [rec])
+            self._apply(mem, rec)
+            mem['records'] += 1
+            return True
+
+    def identities(self):
+        with self.guard:
+            return list(self.mems)
+
+    def snapshot(self, identity='marcus'):
+        mem = self._mem(identity)
+        with mem['lock']:
+            return {'identity': identity, 'messages': list(mem['ring']),
+                    'summary': mem['summary'], 'model': mem['model'], 'ts': mem['ts']}
+
+    # ── compaction ───────────────────────────────────────────────
+    def compact(self, identity):
+        """Rewrite the log as a single replace record of the current archive."""
+        mem = self._mem(identity)
+        with mem['lock']:
+            if mem['records'] <= 1:
+                return
+            path = self._path(identity)
+            tmp  = path.with_suffix('.jsonl.tmp')
+            with open(path, 'a') as lockf:
+                fcntl.flock(lockf, fcntl.LOCK_EX)
+                try:
+                    with open(tmp, 'w') as f:
+                        f.write(json.dumps({'op': 'replace', 'messages': list(mem['archive']),
+                                            'summary': mem['summary'], 'pending': mem['pending'],
+                                            'ts': mem['ts']}) + '\n')
+                        f.flush(); os.fsync(f.fileno())
+                    os.replace(tmp, path)
+                finally:
+                    fcntl.flock(lockf, fcntl.LOCK_UN)
+            mem['records'] = 1
+
+    def _compactor(self):
+        while True:
+            time.sleep(MEMORY_COMPACT_S)
+            with self.guard:
+                due = [i for i, m in self.mems.items() if m['records'] > 2 * self.window]
+            for identity in due:
+                try: self.compact(identity)
+                except OSError as e: print(f'[AMALLO] memory compaction failed for {identity}: {e}')
+
+memory = MemoryStore()
 
 def mem_load(identity='marcus'):
-    p = _mem_path(identity)
-    if p.exists():
-        try: return json.loads(p.read_text())
-        except: pass
-    return {'identity': identity, 'messages': [], 'model': 'dolphin-mistral:latest', 'ts': 0}
-
-def mem_save(data, identity='marcus'):
-    data['ts'] = int(time.time())
-    _mem_path(identity).write_text(json.dumps(data))
-
-def mem_append(role, content, identity='marcus', max_ctx=40):
-    d = mem_load(identity)
-    d['messages'].append({'role': role, 'content': content, 'ts': int(time.time())})
-    # keep last max_ctx messages
-    if len(d['messages']) > max_ctx:
-        d['messages'] = d['messages'][-max_ctx:]
-    mem_save(d, identity)
-    return d
+    return memory.snapshot(identity)
+
+def mem_append(role, content, identity='marcus'):
+    return memory.append(role, content, identity)
+
+def recall_context(identity, messages):
+    """Shared-memory context for a shallow request: the rolling summary and the
+    archived messages most relevant to its user turns as one system note, then
+    the last two turns. Bounded by MEMORY_TOKENS however long memory grows."""
+    seen  = {m.get('content') for m in messages}
+    query = '\n'.join(m['content'] for m in messages
+                      if m.get('role') == 'user' and isinstance(m.get('content'), str))
+    summary, snippets, recent = memory.recall(identity, query, exclude=seen)
+    out = [{'role': m['role'], 'content': m['content']} for m in recent] + messages
+    note = []
+    if summary:
+        note.append(f'Memory summary:\n{summary}')
+    if snippets:
+        note.append('Relevant earlier memory:\n' +
+                    '\n'.join(f"- [{m['role']}] {m['content']}" for m in snippets))
+    if note:
+        # last system message, so inject_sovereign_context puts it after the
+        # persona and client system text and the cached prefix stays stable
+        out.append({'role': 'system', 'content': '\n\n'.join(note)})
+    return out
+
+SUMMARY_PROMPT = """You keep the long-term memory of a continuing conversation with Marcus.
+Rewrite the current summary so it also covers the new messages. Keep facts,
+decisions, names, numbers and open tasks; drop small talk. Plain prose or
+short bullets, under {words} words. Reply with the summary only."""
+
+summary_stats = {'folds': 0, 'messages': 0, 'errors': 0, 'last_error': None, 'last_ms': None}
+
+def summarize(summary, messages):
+    lines = '\n'.join(f"[{m.get('role', 'user')}] {m.get('content', '')[:1200]}" for m in messages)
+    payload = chat_payload(SUMMARY_MODEL, [
+        {'role': 'system', 'content': SUMMARY_PROMPT.format(words=SUMMARY_TOKENS * 3 // 4)},
+        {'role': 'user', 'content': f'Current summary:\n{summary or "(none)"}\n\nNew messages:\n{lines}'},
+    ], SUMMARY_TOKENS, 0.2, False)
+    payload['keep_alive'] = '5m'   # don't pin the small model next to the chat models
+    _, d = UPSTREAMS['ollama'].request('POST', '/api/chat', payload, timeout=300)
+    return d.get('message', {}).get('content', '').strip()
+
+def memory_summarizer():
+    """Fold older memory turns into each identity's summary, one identity at a
+    time and only while no inference is running, so chat traffic never waits."""
+    while True:
+        time.sleep(SUMMARY_EVERY)
+        for identity in memory.identities():
+            if router.idle_for() < SUMMARY_IDLE_S or UPSTREAMS['ollama'].state == 'open':
+                break
+            work = memory.summary_work(identity)
+            if not work:
+                continue
+            gen, summary, batch = work
+            t0 = time.perf_counter()
+            try:
+                text = summarize(summary, batch)
+            except Exception as e:
+                summary_stats['errors'] += 1
+                summary_stats['last_error'] = f'{identity}: {e}'
+                break
+            if text and memory.fold(identity, gen, text, len(batch)):
+                summary_stats['folds'] += 1
+                summary_stats['messages'] += len(batch)
+                summary_stats['last_ms'] = round((time.perf_counter() - t0) * 1000)
+
+threading.Thread(target=memory_summarizer, daemon=True).start()
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that serves each connection on a bounded worker pool, so one
+    long stream or SSH inference no longer blocks /health and everyone else."""
+    def __init__(self, addr, handler, workers=WORKERS):
+        super().__init__(addr, handler)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='amallo')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._serve, request, client_address)
+
+    def _serve(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
 
 class AmalloHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive; every response is length-framed or chunked
+    timeout = KEEPALIVE_S
+
     def log_message(self, *args): pass
 
-    def send_json(self, data, status=200):
+    def send_chunk(self, data):
+        if data:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            self.wfile.flush()
+
+    def end_chunks(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def omni_stream(self):
+        """SSE subscription to omni broadcasts. Honours Last-Event-ID (header or
+        ?last_id=) by replaying newer broadcasts from the buffer first."""
+        qs = dict(p.split('=', 1) for p in urlparse(self.path).query.split('&') if '=' in p)
+        last = self.headers.get('Last-Event-ID') or qs.get('last_id')
+        q = omni_hub.subscribe(int(last) if last and last.isdigit() else None)
+        if q is None:
+            self.send_json({'error': 'too many omni subscribers, poll /amallo/omni'}, 503); return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        try:
+            self.send_chunk(b'retry: 3000\n\n')
+            while True:
+                try:
+                    event = q.get(timeout=OMNI_HEARTBEAT)
+                except queue.Empty:
+                    self.send_chunk(b': ping\n\n')   # also how we notice a dead client
+                    continue
+                if event is None:
+                    break   # fell behind; client reconnects with Last-Event-ID
+                self.send_chunk(b'id: %d\nevent: omni\ndata: %s\n\n' % (event[0], event[1].encode()))
+            self.end_chunks()
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            pass
+        finally:
+            omni_hub.unsubscribe(q)
+            self.close_connection = True
+
+    def relay_stream(self, events, model_name, acct=None):
+        """Relay token events as OpenAI SSE chunks; return the accumulated text.
+
+        Each frame is serialized once around a fixed prefix. Tokens that arrive
+        within STREAM_FRAME_MS of the last flush are coalesced into one frame
+        (the first token always goes out immediately), which is written when
+        that window closes even if no further token arrives. If the client goes
+        away, the event generator is closed, which cancels the upstream generation.
+        If acct is a dict it receives bytes, ttft_ms (from acct['t0']), stats
+        and error.
+        """
+        head = ('data: ' + json.dumps({'id': 'amallo-' + uuid.uuid4().hex[:8],
+                                       'object': 'chat.completion.chunk',
+                                       'created': int(time.time()), 'model': model_name})[:-1]
+                + ', "choices": [{"index": 0, "delta": ').encode()
+        parts, pending = [], []
+        last_flush, first = 0.0, True
+        acct = {} if acct is None else acct
+        acct.setdefault('bytes', 0)
+
+        def frame(delta, finish=None):
+            data = head + json.dumps(delta).encode() + b', "finish_reason": ' + \
+                   json.dumps(finish).encode() + b'}]}\n\n'
+            acct['bytes'] += len(data)
+            return data
+
+        def flush():
+            nonlocal pending, last_flush, first
+            text = ''.join(pending)
+            self.send_chunk(frame({'role': 'assistant', 'content': text} if first else {'content': text}))
+            pending, last_flush, first = [], time.monotonic(), False
+
+        pump = EventPump(events)
+        try:
+            while True:
+                # with tokens held back, wait only until their frame is due
+                due = max(last_flush + STREAM_FRAME_MS / 1000 - time.monotonic(), 0) if pending else None
+                try:
+                    ev = pump.get(due)
+                except queue.Empty:
+                    flush()
+                    continue
+                if ev is None:
+                    break
+                if ev['type'] == 'token':
+                    parts.append(ev['text']); pending.append(ev['text'])
+                    now = time.monotonic()
+                    if 'ttft_ms' not in acct and 't0' in acct:
+                        acct['ttft_ms'] = (now - acct['t0']) * 1000
+                    if now - last_flush >= STREAM_FRAME_MS / 1000 or \
+                            sum(map(len, pending)) >= STREAM_FRAME_CHARS:
+                        flush()
+                    continue
+                if pending:
+                    flush()
+                if ev['type'] == 'error':
+                    acct['error'] = ev['error']
+                    self.send_chunk(frame({'content': f"[Stream error: {ev['error']}]"}, 'stop'))
+                else:
+                    acct['stats'] = ev.get('stats', {})
+                    self.send_chunk(frame({}, 'stop'))
+            if pending:
+                flush()
+            self.send_chunk(b'data: [DONE]\n\n')
+            self.end_chunks()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+            acct.setdefault('error', 'client disconnected')
+        finally:
+            pump.close()
+        return ''.join(parts)
+
+    def send_json(self, data, status=200, headers=None):
         body = json.dumps(data).encode()
         self.send_response(status)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Content-Length', len(body))
         self.send_header('Access-Control-Allow-Origin', '*')
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
         self.end_headers()
         self.wfile.write(body)
+        return len(body)
 
     def auth(self):
         return keys.validate(self.headers.get('Authorization', ''))
@@ -351,6 +2120,7 @@ class AmalloHandler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET,POST,DELETE,OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Authorization,Content-Type')
+        self.send_header('Content-Length', 0)
         self.end_headers()
 
     def do_GET(self):
@@ -366,7 +2136,20 @@ class AmalloHandler(BaseHTTPRequestHandler):
             if not ok: self.send_json({'error': 'unauthorized'}, 401); return
             self.send_json({'object': 'list', 'data': [
                 {'id': m, 'object': 'model', 'owned_by': 'amallo'}
-                for m in models.available()]}); return
+                for m in models.available()], **inventory.freshness()}); return
+
+        if path == '/amallo/stats':
+            ok, info = self.auth()
+            if not ok: self.send_json({'error': 'unauthorized'}, 401); return
+            qs = dict(p.split('=', 1) for p in urlparse(self.path).query.split('&') if '=' in p)
+            window = parse_window(qs.get('window'))
+            group = tuple(g for g in qs.get('group', 'identity,model').split(',') if g in ('identity', 'model'))
+            identity = qs.get('identity')
+            if not info or info.get('role') != 'master':
+                identity = info.get('identity') if info else None   # non-master keys see only themselves
+            self.send_json({'window_s': window, 'group': list(group), 'identity': identity,
+                            'model': qs.get('model'),
+                            'rows': usage.query(window, identity, qs.get('model'), group)}); return
 
         if path == '/amallo/status':
             ok, info = self.auth()
@@ -377,8 +2160,25 @@ class AmalloHandler(BaseHTTPRequestHandler):
                             'disk_free_gb': round(free/1e9,1), 'ram_gb': 32, 'cpus': 8,
                             'backend': 'ollama', 'sovereign': True,
                             'ssh_sessions_active': len(ssh_sessions),
+                            'workers': WORKERS,
+                            'upstreams': {n: u.status() for n, u in list(UPSTREAMS.items())},
+                            'routing': router.status(),
+                            'omni': omni_hub.status(),
+                            'dedup': singleflight.status(),
+                            'queue': scheduler.status(),
+                            'warming': warmer.status(),
+                            'memory_summary': dict(summary_stats, model=SUMMARY_MODEL),
+                            'inventory_age_s': {src: v['age_s'] for src, v in inventory.snapshot()['sources'].items()},
                             'operator': info.get('identity') if info else None}); return
 
+        if path == '/amallo/models':
+            ok, _ = self.auth()
+            if not ok: self.send_json({'error': 'unauthorized'}, 401); return
+            if 'refresh' in urlparse(self.path).query:
+                inventory.refresh()
+            self.send_json({'current': models.current, 'files': models.available_gguf(),
+                            **inventory.snapshot()}); return
+
         if path == '/mesh/nodes':
             self.send_json({'mesh': 'sovereign-stack', 'nodes': [
                 {'id': 'model',    'ip': '187.77.208.28', 'role': 'MODEL',    'status': 'active',
@@ -412,7 +2212,11 @@ class AmalloHandler(BaseHTTPRequestHandler):
             self.send_json(keys.list_keys()); return
 
         if path == '/amallo/omni':
-            self.send_json(omni_msg); return
+            with omni_lock: snapshot = dict(omni_msg)
+            self.send_json(snapshot); return
+
+        if path == '/amallo/omni/stream':
+            self.omni_stream(); return
 
         # ── shared memory ──────────────────────────────────────────────────────
         if path.startswith('/amallo/memory'):
@@ -430,12 +2234,13 @@ class AmalloHandler(BaseHTTPRequestHandler):
             ok, info = self.auth()
             if not ok or info.get('role') != 'master':
                 self.send_json({'error': 'master key required'}, 401); return
-            omni_msg.update({'text':'','from':'','ts':0,'active':False})
+            with omni_lock:
+                omni_msg.update({'text':'','from':'','ts':int(time.time()),'active':False})
+                omni_hub.publish(dict(omni_msg))
             self.send_json({'cleared': True}); return
         self.send_json({'error': 'not found'}, 404)
 
     def do_POST(self):
-        global omni_msg
         path   = urlparse(self.path).path
         length = int(self.headers.get('Content-Length', 0))
         body   = json.loads(self.rfile.read(length)) if length else {}
@@ -461,9 +2266,12 @@ class AmalloHandler(BaseHTTPRequestHandler):
                 if not ok or info.get('role') != 'master':
                     self.send_json({'error': 'admin password required'}, 401); return
                 from_id = info.get('identity', 'axis')
-            omni_msg = {'text': text, 'from': from_id,
-                        'ts': int(time.time()), 'active': bool(text)}
-            self.send_json({'broadcast': True, 'text': text, 'active': omni_msg['active']}); return
+            with omni_lock:
+                omni_msg.update({'text': text, 'from': from_id,
+                                 'ts': int(time.time()), 'active': bool(text)})
+                event_id = omni_hub.publish(dict(omni_msg))
+            self.send_json({'broadcast': True, 'text': text, 'active': bool(text),
+                            'id': event_id, 'subscribers': omni_hub.status()['subscribers']}); return
 
         # ── shared memory write ───────────────────────────────────────────────
         if path == '/amallo/memory':
@@ -472,14 +2280,14 @@ class AmalloHandler(BaseHTTPRequestHandler):
             identity = body.get('identity', info.get('identity','marcus') if info else 'marcus')
             action   = body.get('action', 'append')
             if action == 'replace':
-                d = mem_load(identity); d['messages'] = body.get('messages', []); mem_save(d, identity)
-                self.send_json({'saved': True, 'count': len(d['messages'])}); return
+                count = memory.replace(body.get('messages', []), identity)
+                self.send_json({'saved': True, 'count': count}); return
             elif action == 'clear':
-                d = mem_load(identity); d['messages'] = []; mem_save(d, identity)
+                memory.clear(identity)
                 self.send_json({'cleared': True}); return
             else:
-                d = mem_append(body.get('role','user'), body.get('content',''), identity)
-                self.send_json({'saved': True, 'count': len(d['messages'])}); return
+                count = mem_append(body.get('role','user'), body.get('content',''), identity)
+                self.send_json({'saved': True, 'count': count}); return
 
         if path == '/amallo/ssh/connect':
             if not PARAMIKO:
@@ -493,8 +2301,10 @@ class AmalloHandler(BaseHTTPRequestHandler):
                 client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
                 client.connect(host, port=port, username=user, password=password, timeout=12)
                 sid = uuid.uuid4().hex
+                sess = {'client':client,'host':host,'user':user,'port':port,'ts':time.time()}
+                ssh_tunnels(sid, sess)
                 with ssh_lock:
-                    ssh_sessions[sid] = {'client':client,'host':host,'user':user,'port':port,'ts':time.time()}
+                    ssh_sessions[sid] = sess
                 self.send_json({'session_id':sid,'connected':True,'host':host,'user':user})
             except paramiko.AuthenticationException:
                 self.send_json({'error':'Authentication failed — wrong password or user'},401)
@@ -526,12 +2336,30 @@ class AmalloHandler(BaseHTTPRequestHandler):
             with ssh_lock: sess = ssh_sessions.get(sid)
             if not sess: self.send_json({'error':'session not found or expired — reconnect'},404); return
             sess['ts'] = time.time()
-            result, backend = run_inference_ssh(sess, messages, model, max_tok, temp)
+            if body.get('stream', False):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.relay_stream(run_inference_stream(model, messages, max_tok, temp,
+                                                       upstream=sess['ollama']), model)
+                return
+            hop = {}
+            result, backend = run_inference_ssh(sess, messages, model, max_tok, temp, info=hop)
             if result:
+                rtt = sess.get('ssh_rtt_ms') or 0
                 self.send_json({'id':'ssh-'+uuid.uuid4().hex[:8],'object':'chat.completion',
                                 'created':int(time.time()),'model':model,
                                 'choices':[{'index':0,'message':{'role':'assistant','content':result},'finish_reason':'stop'}],
-                                'sovereign':True,'node':f"{sess['user']}@{sess['host']}",'backend':backend})
+                                'sovereign':True,'node':f"{sess['user']}@{sess['host']}",'backend':backend,
+                                'tunnel':{'reused': hop.get('reused', False),
+                                          'tunnels_opened': sess.get('tunnels_opened', 0),
+                                          'hops_ms': {'controller_to_node': rtt,
+                                                      'node_to_backend_ttfb': round(max(hop.get('ttfb_ms', 0) - rtt, 0), 1),
+                                                      'tunnel_open': hop.get('connect_ms', 0),
+                                                      'total': hop.get('total_ms', 0)}}})
             else:
                 self.send_json({'error':'No inference backend on remote.',
                                 'hint':'Install ollama: curl -fsSL https://ollama.com/install.sh | sh && ollama pull dolphin-mistral'},503)
@@ -541,8 +2369,7 @@ class AmalloHandler(BaseHTTPRequestHandler):
             sid = body.get('session_id','')
             with ssh_lock: sess = ssh_sessions.pop(sid, None)
             if sess:
-                try: sess['client'].close()
-                except: pass
+                ssh_close(sess)
                 self.send_json({'disconnected':True})
             else:
                 self.send_json({'disconnected':False,'error':'session not found'})
@@ -554,17 +2381,19 @@ class AmalloHandler(BaseHTTPRequestHandler):
                 self.send_json({'error':'unauthorized',
                                 'hint':'POST /amallo/keys/create with {"identity":"yourname"} to get a sovereign key'},401); return
             identity = (info.get('identity') if info else None) or body.get('identity', 'marcus')
+            t0 = time.monotonic()
+            retry = scheduler.admit(identity, info)
+            if retry:
+                usage.record(identity, models.resolve_ollama(body.get('model', 'current')), rejected=True)
+                self.send_json({'error': 'rate limited', 'identity': identity,
+                                'retry_after_s': round(retry, 1)}, 429,
+                               {'Retry-After': str(math.ceil(retry))}); return
             messages = body.get('messages',[])
             if not messages and body.get('message'): messages=[{'role':'user','content':body['message']}]
             if not messages and body.get('prompt'):  messages=[{'role':'user','content':body['prompt']}]
             # ── shared memory: prepend history if client sends shallow context ──
             if body.get('use_memory', True) and len(messages) <= 3:
-                mem = mem_load(identity)
-                prior = mem.get('messages', [])[-20:]  # last 20 exchanges
-                # only inject prior non-system messages that aren't already there
-                existing_contents = {m['content'] for m in messages}
-                inject = [m for m in prior if m.get('content') not in existing_contents]
-                messages = inject + messages
+                messages = recall_context(identity, messages)
             # ── persist user message ───────────────────────────────────────────
             user_msgs = [m for m in messages if m.get('role') == 'user']
             if user_msgs:
@@ -576,37 +2405,93 @@ class AmalloHandler(BaseHTTPRequestHandler):
             messages = inject_sovereign_context(model_name, messages)
             max_tok = body.get('max_tokens', 2048)
             temp    = body.get('temperature', 0.7)
-            if body.get('stream', False):
-                self.send_response(200)
-                self.send_header('Content-Type', 'text/event-stream')
-                self.send_header('Cache-Control', 'no-cache')
-                self.send_header('Connection', 'keep-alive')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                full_response = []
-                for chunk in run_inference_stream(model_name, messages, max_tok, temp):
-                    self.wfile.write(chunk)
-                    self.wfile.flush()
-                    # collect tokens for memory
-                    try:
-                        import re as _re
-                        for line in chunk.decode().split('\n'):
-                            if line.startswith('data:') and '[DONE]' not in line:
-                                tok = json.loads(line[5:].strip())['choices'][0]['delta'].get('content','')
-                                full_response.append(tok)
+            route_key = body.get('session') or self.headers.get('X-Amallo-Session')
+            # greedy decoding is deterministic, so identical requests can share one
+            # generation; clients can opt other retries in with X-Amallo-Dedup
+            dedup = temp == 0 or self.headers.get('X-Amallo-Dedup', '').lower() in ('1', 'true', 'on')
+            stream = body.get('stream', False)
+            lane   = classify_lane(self.headers, info, body)
+            fkey   = singleflight.key(model_name, messages, max_tok, temp, stream, lane) if dedup else None
+            # a request joining an identical flight generates nothing, so takes no slot
+            ticket = None
+            weight = (info or {}).get('weight', 1)
+            if not (fkey and singleflight.live(fkey)):
+                ticket = scheduler.acquire(identity, weight, lane)
+                if ticket is None:
+                    usage.record(identity, model_name, rejected=True,
+                                 total_ms=(time.monotonic() - t0) * 1000)
+                    self.send_json({'error': 'inference queue full or timed out', 'identity': identity}, 503,
+                                   {'Retry-After': str(math.ceil(scheduler.service))}); return
+            def start():
+                if lane == 'batch':
+                    src = resumable_events(model_name, messages, max_tok, temp, route_key)
+                elif stream:
+                    src = run_inference_stream(model_name, messages, max_tok, temp, route_key=route_key)
+                else:
+                    src = inference_events(model_name, messages, max_tok, temp, route_key)
+                return scheduler.hold(ticket, src, identity, weight, lane)
+            # hold() frees the slot only once iterated: until the first event is
+            # pulled (or a flight's thread takes it over), a failure here must
+            # hand the slot back itself
+            flown = False
+            try:
+                if fkey:
+                    events, joined = singleflight.events(fkey, start)
+                    flown = True
+                else:
+                    events, joined = start(), False
+                if joined and ticket:
+                    scheduler.release(ticket)   # the flight we raced with took off first
+                queue_hdrs = {'X-Amallo-Lane': lane,
+                              'X-Amallo-Queue-Position': str(ticket['position'] if ticket else 0),
+                              'X-Amallo-Queue-Wait-Ms': str(ticket['wait_ms'] if ticket else 0)}
+                if stream:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/event-stream')
+                    self.send_header('Cache-Control', 'no-cache')
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.send_header('Access-Control-Allow-Origin', '*')
+                    if fkey: self.send_header('X-Amallo-Dedup', 'joined' if joined else 'leader')
+                    for k, v in queue_hdrs.items(): self.send_header(k, v)
+                    self.end_headers()
+            except BaseException:
+                if ticket and not flown: scheduler.abandon(ticket)
+                raise
+            if stream:
+                acct = {'t0': t0}
+                text = self.relay_stream(events, model_name, acct)
+                stats = acct.get('stats', {})
+                usage.record(identity, model_name, acct.get('ttft_ms'), (time.monotonic() - t0) * 1000,
+                             0 if joined else stats.get('prompt_eval_count', 0),
+                             0 if joined else stats.get('eval_count', 0),
+                             acct['bytes'], error='error' in acct, deduped=joined)
+                if not joined: warmer.observe(model_name, stats)
+                if text:
+                    try: mem_append('assistant', text, identity)
                     except: pass
-                try: mem_append('assistant', ''.join(full_response), identity)
-                except: pass
                 return
-            text = run_inference(model_name, messages, max_tok, temp)
+            route, text, stats, error = {}, '', {}, None
+            for ev in events:
+                if ev['type'] == 'token': text += ev['text']
+                elif ev['type'] == 'done': route['node'] = ev.get('node'); stats = ev.get('stats', {})
+                elif ev['type'] == 'error': error = ev['error']
             # ── persist assistant response ─────────────────────────────────────
             try: mem_append('assistant', text, identity)
             except: pass
-            self.send_json({'id':'amallo-'+uuid.uuid4().hex[:8],'object':'chat.completion',
+            sent = self.send_json({'id':'amallo-'+uuid.uuid4().hex[:8],'object':'chat.completion',
                             'created':int(time.time()),'model':model_name,
                             'choices':[{'index':0,'message':{'role':'assistant','content':text},'finish_reason':'stop'}],
                             'sovereign':True,'node':'amallo-controller',
-                            'operator':identity}); return
+                            'routed_to':route.get('node', 'llama-cli'),
+                            'deduplicated':joined,
+                            'operator':identity},
+                           headers=dict(queue_hdrs, **{'X-Amallo-Preemptions': str(ticket['preemptions'] if ticket else 0)}))
+            usage.record(identity, model_name, None, (time.monotonic() - t0) * 1000,
+                         0 if joined else stats.get('prompt_eval_count', 0),
+                         0 if joined else stats.get('eval_count', 0),
+                         sent, error=bool(error or not text), deduped=joined)
+            if not joined: warmer.observe(model_name, stats)
+            return
 
         self.send_json({'error':'not found'},404)
 
@@ -616,4 +2501,5 @@ if __name__ == '__main__':
     print(f'[AMALLO] SSH relay: {"ENABLED (paramiko)" if PARAMIKO else "DISABLED — pip install paramiko"}')
     print(f'[AMALLO] Default: {models.current}')
     print(f'[AMALLO] Available: {models.available()}')
-    HTTPServer(('127.0.0.1', PORT), AmalloHandler).serve_forever()
+    print(f'[AMALLO] Workers: {WORKERS} (HTTP/1.1 keep-alive)')
+    PooledHTTPServer(('127.0.0.1', PORT), AmalloHandler).serve_forever()
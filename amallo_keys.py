@@ -0,0 +1,195 @@
+"""
+AMALLO - Shared key store
+One keys.json for every node process (amallo_server, amallo_controller, vision-ws).
+
+  validate()  in-memory dict lookup, no disk I/O on the hot path
+  usage       counted in memory, appended to keys.json.usage in batches,
+              folded into keys.json by compaction (atomic os.replace)
+  reload      keys.json mtime is watched; keys created or revoked by another
+              process show up without a restart
+"""
+import json, os, time, threading, atexit, fcntl, uuid, secrets, string
+
+KEYS_FILE      = '/root/amallo/keys.json'
+FLUSH_EVERY    = 5.0          # seconds between usage-log appends
+FLUSH_BATCH    = 256          # or sooner, once this many increments are pending
+COMPACT_BYTES  = 256 * 1024   # fold the usage log into the snapshot past this size
+RELOAD_EVERY   = 2.0          # seconds between keys.json mtime checks
+
+
+def sov_key():
+    """amallo_server format: SOV-XXXX-XXXX-XXXX-XXXX"""
+    return 'SOV-' + '-'.join(uuid.uuid4().hex[:4].upper() for _ in range(4))
+
+
+def sov_token():
+    """amallo_controller format: 'sov' + 40 random alphanumerics"""
+    alphabet = string.ascii_letters + string.digits
+    return 'sov' + ''.join(secrets.choice(alphabet) for _ in range(40))
+
+
+class KeyStore:
+    def __init__(self, path=KEYS_FILE, new_key=sov_key, bootstrap=('marcus', 'master')):
+        self.path     = path
+        self.log_path = path + '.usage'
+        self.new_key  = new_key
+        self.keys     = {}     # key -> record (requests = snapshot + replayed log)
+        self.pending  = {}     # key -> increments not yet in the usage log
+        self.mtime    = None
+        self.lock     = threading.Lock()
+        self._load()
+        if not self.keys and bootstrap and not os.path.exists(path):
+            master = self.create(*bootstrap)
+            print(f'[AMALLO] Bootstrap master key: {master}')
+        threading.Thread(target=self._background, daemon=True).start()
+        atexit.register(self.flush)
+
+    # ── disk ──────────────────────────────────────────────────────
+    def _flock(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    @staticmethod
+    def _unlock(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _read_snapshot(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _read_log(self):
+        counts = {}
+        try:
+            with open(self.log_path) as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue   # torn tail from a crashed writer
+                    counts[rec['k']] = counts.get(rec['k'], 0) + rec['n']
+        except FileNotFoundError:
+            pass
+        return counts
+
+    def _load(self):
+        """Snapshot + usage log + our unflushed increments. Read under the file
+        lock: a compaction is never seen half done, and flush() moves pending
+        into the log under the same lock, so each increment is counted once."""
+        fd = self._flock()
+        try:
+            stat = self._stat()
+            keys = self._read_snapshot()
+            for k, n in self._read_log().items():
+                if k in keys:
+                    keys[k]['requests'] = keys[k].get('requests', 0) + n
+            with self.lock:
+                for k, n in self.pending.items():
+                    if k in keys:
+                        keys[k]['requests'] = keys[k].get('requests', 0) + n
+                self.keys, self.mtime = keys, stat
+        finally:
+            self._unlock(fd)
+
+    def _write_snapshot(self, keys):
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(keys, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def _compact(self, mutate=None):
+        """Fold the usage log into keys.json, optionally mutating it, under the file lock."""
+        fd = self._flock()
+        try:
+            keys = self._read_snapshot()
+            for k, n in self._read_log().items():
+                if k in keys:
+                    keys[k]['requests'] = keys[k].get('requests', 0) + n
+            if mutate:
+                mutate(keys)
+            self._write_snapshot(keys)
+            open(self.log_path, 'w').close()
+        finally:
+            self._unlock(fd)
+        self._load()
+
+    # ── write-behind usage ────────────────────────────────────────
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+        fd = self._flock()   # pending leaves memory and lands in the log atomically for _load()
+        try:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+            ts = int(time.time())
+            lines = ''.join(json.dumps({'k': k, 'n': n, 'ts': ts}) + '\n' for k, n in batch.items())
+            with open(self.log_path, 'a') as f:
+                f.write(lines)
+            size = os.path.getsize(self.log_path)
+        finally:
+            self._unlock(fd)
+        if size > COMPACT_BYTES:
+            self._compact()
+
+    def _background(self):
+        last_flush = time.time()
+        while True:
+            time.sleep(RELOAD_EVERY)
+            if self._stat() != self.mtime:
+                self._load()
+            with self.lock:
+                backlog = sum(self.pending.values())
+            if backlog >= FLUSH_BATCH or time.time() - last_flush >= FLUSH_EVERY:
+                try: self.flush()
+                except OSError as e: print(f'[AMALLO] usage flush failed: {e}')
+                last_flush = time.time()
+
+    # ── API ───────────────────────────────────────────────────────
+    def validate(self, header):
+        key = (header or '').replace('Bearer ', '').strip()
+        rec = self.keys.get(key)
+        if rec is None and key and self._stat() != self.mtime:
+            self._load()   # maybe minted by another process since our last poll
+            rec = self.keys.get(key)
+        if rec is None:
+            return False, None
+        with self.lock:
+            rec['requests'] = rec.get('requests', 0) + 1
+            self.pending[key] = self.pending.get(key, 0) + 1
+        return True, rec
+
+    def create(self, identity, role='user'):
+        key = self.new_key()
+        rec = {'identity': identity, 'role': role,
+               'created': time.strftime('%Y-%m-%dT%H:%M:%SZ'), 'requests': 0}
+        self._compact(lambda keys: keys.__setitem__(key, rec))
+        return key
+
+    def revoke(self, key):
+        found = key in self.keys
+        self._compact(lambda keys: keys.pop(key, None))
+        with self.lock:
+            self.pending.pop(key, None)
+        return found
+
+    def list_keys(self):
+        return self.keys
+
+    def __contains__(self, key):
+        return key in self.keys
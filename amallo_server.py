@@ -3,14 +3,25 @@ AMALLO - Sovereign GGUF Inference Server
 OpenAI-compatible API. Clean slate. Scale-invariant.
 Replaces: model_server.py + sovereign_api.py + kelushell soup
 """
-import json, time, uuid, os, subprocess, threading
+import json, time, uuid, os, subprocess, threading, socket, atexit
+import http.client, urllib.request
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse
+from amallo_keys import KeyStore, sov_key
 
 MODELS_DIR    = '/root/axis-mundi/models'
 KEYS_FILE     = '/root/amallo/keys.json'
 PORT          = 8200
 DEFAULT_MODEL = 'Qwen2.5-Coder-7B-Instruct-abliterated.Q5_K_M.gguf'
+OLLAMA_URL    = 'http://127.0.0.1:11434'
+
+# llama-server pool: one long-lived process per model, reaped when idle
+LLAMA_SERVERS      = ['/usr/local/bin/llama-server', '/usr/bin/llama-server']
+LLAMA_CTX          = int(os.environ.get('AMALLO_LLAMA_CTX', 4096))
+LLAMA_IDLE_TIMEOUT = int(os.environ.get('AMALLO_LLAMA_IDLE', 600))    # seconds
+LLAMA_MAX_PROCS    = int(os.environ.get('AMALLO_LLAMA_MAX_PROCS', 2))  # resident models
+LLAMA_START_WAIT   = 120                                                # model load budget
+LLAMA_HEALTH_EVERY = 15
 
 MODEL_ALIASES = {
     'qwen':       'Qwen2.5-Coder-7B-Instruct-abliterated.Q5_K_M.gguf',
@@ -25,51 +36,6 @@ MODEL_ALIASES = {
     'current':    DEFAULT_MODEL,
 }
 
-# ── KEY MANAGER ────────────────────────────────────────────────
-class KeyManager:
-    def __init__(self):
-        self.keys = {}
-        self._load()
-
-    def _load(self):
-        if os.path.exists(KEYS_FILE):
-            with open(KEYS_FILE) as f:
-                self.keys = json.load(f)
-        else:
-            master = self._gen('marcus', 'master')
-            print(f'[AMALLO] Bootstrap master key: {master}')
-
-    def _save(self):
-        os.makedirs(os.path.dirname(KEYS_FILE), exist_ok=True)
-        with open(KEYS_FILE, 'w') as f:
-            json.dump(self.keys, f, indent=2)
-
-    def _gen(self, identity, role='user'):
-        parts = [uuid.uuid4().hex[:4].upper() for _ in range(4)]
-        key = 'SOV-' + '-'.join(parts)
-        self.keys[key] = {
-            'identity': identity,
-            'role': role,
-            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ'),
-            'requests': 0
-        }
-        self._save()
-        return key
-
-    def validate(self, header):
-        key = (header or '').replace('Bearer ', '').strip()
-        if key in self.keys:
-            self.keys[key]['requests'] += 1
-            self._save()
-            return True, self.keys[key]
-        return False, None
-
-    def create(self, identity, role='user'):
-        return self._gen(identity, role)
-
-    def list_keys(self):
-        return self.keys
-
 # ── MODEL MANAGER ──────────────────────────────────────────────
 class ModelManager:
     def __init__(self):
@@ -114,42 +80,278 @@ def build_prompt(messages):
     prompt += '<|assistant|>\n'
     return prompt
 
+class LlamaServerPool:
+    """Supervises llama-server processes: started on demand, health-checked,
+    restarted when they crash, reaped when idle. Requests are forwarded to
+    them over local HTTP, so a model is loaded once rather than per request."""
+
+    def __init__(self):
+        self.procs = {}   # model_path -> entry dict
+        self.lock  = threading.Lock()
+        threading.Thread(target=self._supervise, daemon=True).start()
+        atexit.register(self.shutdown)
+
+    def binary(self):
+        for b in LLAMA_SERVERS:
+            if os.path.exists(b):
+                return b
+        return None
+
+    @staticmethod
+    def _free_port():
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    @staticmethod
+    def _healthy(entry, timeout=2):
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', entry['port'], timeout=timeout)
+            conn.request('GET', '/health')
+            ok = conn.getresponse().status == 200
+            conn.close()
+            return ok
+        except Exception:
+            return False
+
+    def _alive(self, entry):
+        return entry['proc'] is not None and entry['proc'].poll() is None
+
+    def _spawn(self, entry):
+        entry['port'] = self._free_port()
+        entry['proc'] = subprocess.Popen(
+            [self.binary(), '-m', entry['model'], '--host', '127.0.0.1',
+             '--port', str(entry['port']), '-c', str(LLAMA_CTX)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        entry['started'] = time.time()
+        deadline = entry['started'] + LLAMA_START_WAIT
+        while time.time() < deadline:
+            if not self._alive(entry):
+                break
+            if self._healthy(entry):
+                return True
+            time.sleep(0.25)
+        self._stop(self._detach(entry))
+        return False
+
+    @staticmethod
+    def _detach(entry):
+        """Take the process off its entry (under self.lock for a shared entry);
+        it is stopped with _stop() once the lock is released."""
+        proc, entry['proc'] = entry.get('proc'), None
+        return proc
+
+    @staticmethod
+    def _stop(*procs):
+        """Terminate, then wait up to 10s before killing. Can block: never call
+        it holding self.lock."""
+        procs = [p for p in procs if p and p.poll() is None]
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try: proc.wait(timeout=10)
+            except subprocess.TimeoutExpired: proc.kill()
+
+    def acquire(self, model_path):
+        """Return (entry, cold, startup_s) with entry['inflight'] bumped, or (None, ...) on failure."""
+        if not self.binary():
+            return None, False, 0.0
+        with self.lock:
+            entry = self.procs.get(model_path)
+            spawn = entry is None or (entry['ready'].is_set() and not self._alive(entry))
+            if entry is None:
+                entry = {'model': model_path, 'proc': None, 'port': None, 'started': 0,
+                         'last_used': time.time(), 'inflight': 0, 'restarts': 0,
+                         'requests': 0, 'ready': threading.Event()}
+                self.procs[model_path] = entry
+            elif spawn:
+                entry['restarts'] += 1
+                entry['ready'] = threading.Event()
+            entry['inflight'] += 1
+            ready = entry['ready']
+            evicted = self._evict_idle(keep=model_path) if spawn else []
+
+        t0 = time.time()
+        self._stop(*evicted)   # free their memory before loading another model
+        if spawn:
+            ok = self._spawn(entry)
+            ready.set()
+        else:
+            ready.wait(LLAMA_START_WAIT)
+            ok = self._alive(entry)
+        if not ok:
+            self.release(entry)
+            return None, spawn, time.time() - t0
+        return entry, spawn, time.time() - t0
+
+    def release(self, entry):
+        with self.lock:
+            entry['inflight'] -= 1
+            entry['requests'] += 1
+            entry['last_used'] = time.time()
+
+    def _evict_idle(self, keep):
+        """Caller holds self.lock. Drop LRU idle servers beyond LLAMA_MAX_PROCS
+        and return their processes for the caller to _stop() after unlocking."""
+        live = [e for k, e in self.procs.items() if k != keep and self._alive(e)]
+        live.sort(key=lambda e: e['last_used'])
+        evicted = []
+        while len(live) >= LLAMA_MAX_PROCS:
+            victim = live.pop(0)
+            if victim['inflight']:
+                continue
+            evicted.append(self._detach(victim))
+            del self.procs[victim['model']]
+        return evicted
+
+    def _supervise(self):
+        while True:
+            time.sleep(LLAMA_HEALTH_EVERY)
+            now = time.time()
+            with self.lock:
+                entries = [e for e in self.procs.values() if e['ready'].is_set()]
+            for e in entries:
+                # counters are read under the lock; processes are stopped outside it
+                with self.lock:
+                    reap = e['inflight'] == 0 and now - e['last_used'] > LLAMA_IDLE_TIMEOUT \
+                        and self.procs.get(e['model']) is e
+                    if reap:
+                        del self.procs[e['model']]
+                        proc = self._detach(e)
+                if reap:
+                    self._stop(proc)
+                    continue
+                if self._alive(e) and not self._healthy(e, timeout=5):
+                    with self.lock:
+                        proc = self._detach(e) if e['inflight'] == 0 else None
+                    self._stop(proc)   # wedged — next acquire() restarts it
+                with self.lock:
+                    revive = not self._alive(e) and e['inflight'] == 0 and \
+                        now - e['last_used'] < LLAMA_IDLE_TIMEOUT and self.procs.get(e['model']) is e
+                if revive:
+                    # crashed while still in demand: bring it back before the next request
+                    entry, _, _ = self.acquire(e['model'])
+                    if entry: self.release(entry)
+
+    def shutdown(self):
+        with self.lock:
+            procs = [self._detach(e) for e in self.procs.values()]
+            self.procs.clear()
+        self._stop(*procs)
+
+    def status(self):
+        with self.lock:
+            return [{'model': os.path.basename(e['model']), 'port': e['port'],
+                     'alive': self._alive(e), 'inflight': e['inflight'],
+                     'requests': e['requests'], 'restarts': e['restarts'],
+                     'uptime_s': round(time.time() - e['started']) if e['started'] else 0,
+                     'idle_s': round(time.time() - e['last_used'])}
+                    for e in self.procs.values()]
+
+
+def _llama_request(entry, messages, max_tokens, temperature, stream):
+    conn = http.client.HTTPConnection('127.0.0.1', entry['port'], timeout=300)
+    conn.request('POST', '/v1/chat/completions', json.dumps({
+        'messages': messages, 'max_tokens': max_tokens,
+        'temperature': temperature, 'stream': stream,
+    }), {'Content-Type': 'application/json'})
+    r = conn.getresponse()
+    if r.status != 200:
+        err = r.read().decode('utf-8', errors='replace')[:200]
+        conn.close()
+        raise RuntimeError(f'llama-server {r.status}: {err}')
+    return conn, r
+
+
+def _ollama_request(model_path, messages, max_tokens, temperature, stream):
+    model_name = os.path.basename(model_path).replace('.gguf', '')
+    data = json.dumps({
+        'model': model_name, 'prompt': build_prompt(messages), 'stream': stream,
+        'options': {'num_predict': max_tokens, 'temperature': temperature}
+    }).encode()
+    req = urllib.request.Request(OLLAMA_URL + '/api/generate', data=data, method='POST')
+    req.add_header('Content-Type', 'application/json')
+    return urllib.request.urlopen(req, timeout=300)
+
+
+def _meta(engine, cold, startup_s, t0, entry=None):
+    meta = {'engine': engine, 'cold': cold,
+            'startup_ms': round(startup_s * 1000),
+            'latency_ms': round((time.time() - t0) * 1000)}
+    if entry:
+        meta['port'] = entry['port']
+    return meta
+
+
 def run_inference(model_path, messages, max_tokens=2048, temperature=0.7):
-    prompt = build_prompt(messages)
+    """Return (text, meta). meta reports engine plus cold/warm start latency."""
+    t0 = time.time()
+    entry, cold, startup_s = pool.acquire(model_path)
+    if entry:
+        try:
+            conn, r = _llama_request(entry, messages, max_tokens, temperature, False)
+            out = json.loads(r.read())['choices'][0]['message']['content']
+            conn.close()
+            return out, _meta('llama-server', cold, startup_s, t0, entry)
+        except Exception:
+            pass
+        finally:
+            pool.release(entry)
 
-    # Try llama-cli
-    for cli in ['/usr/local/bin/llama-cli', '/usr/bin/llama-cli']:
-        if os.path.exists(cli):
+    # Fallback: ollama HTTP
+    try:
+        with _ollama_request(model_path, messages, max_tokens, temperature, False) as r:
+            return json.loads(r.read()).get('response', ''), _meta('ollama', cold, startup_s, t0)
+    except Exception as e:
+        return f'[inference error: {e}]', _meta('none', cold, startup_s, t0)
+
+
+def run_inference_stream(model_path, messages, max_tokens=2048, temperature=0.7, meta=None):
+    """Yield OpenAI SSE bytes. Fills meta (if given) with engine and cold/warm latency."""
+    meta = meta if meta is not None else {}
+    t0 = time.time()
+    entry, cold, startup_s = pool.acquire(model_path)
+    if entry:
+        try:
             try:
-                cmd = [cli, '-m', model_path, '-p', prompt,
-                       '-n', str(max_tokens), '--temp', str(temperature),
-                       '--no-display-prompt', '-q']
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
-                out = result.stdout.strip()
-                if out:
-                    return out
-            except Exception:
-                pass
+                conn, r = _llama_request(entry, messages, max_tokens, temperature, True)
+            except (RuntimeError, OSError):
+                conn = None
+            if conn:
+                meta.update(_meta('llama-server', cold, startup_s, t0, entry))
+                try:
+                    for line in r:
+                        yield line
+                finally:
+                    conn.close()
+                return
+        finally:
+            pool.release(entry)
 
-    # Fallback: ollama HTTP
+    model_id = 'amallo-' + uuid.uuid4().hex[:8]
+    meta.update(_meta('ollama', cold, startup_s, t0))
     try:
-        import urllib.request
-        model_name = os.path.basename(model_path).replace('.gguf', '')
-        data = json.dumps({
-            'model': model_name, 'prompt': prompt,
-            'stream': False, 'options': {'num_predict': max_tokens}
-        }).encode()
-        req = urllib.request.Request(
-            'http://127.0.0.1:11434/api/generate', data=data, method='POST')
-        req.add_header('Content-Type', 'application/json')
-        with urllib.request.urlopen(req, timeout=120) as r:
-            return json.loads(r.read()).get('response', '')
+        with _ollama_request(model_path, messages, max_tokens, temperature, True) as r:
+            for raw in r:
+                if not raw.strip():
+                    continue
+                chunk = json.loads(raw)
+                if chunk.get('response'):
+                    yield ('data: ' + json.dumps({
+                        'id': model_id, 'object': 'chat.completion.chunk',
+                        'created': int(time.time()), 'model': os.path.basename(model_path),
+                        'choices': [{'index': 0, 'delta': {'content': chunk['response']},
+                                     'finish_reason': None}]}) + '\n\n').encode()
+                if chunk.get('done'):
+                    break
     except Exception as e:
-        return f'[inference error: {e}]'
+        yield ('data: ' + json.dumps({'error': f'inference error: {e}'}) + '\n\n').encode()
+    yield b'data: [DONE]\n\n'
 
 # ── HTTP HANDLER ───────────────────────────────────────────────
-keys   = KeyManager()
+keys   = KeyStore(KEYS_FILE, new_key=sov_key)
 models = ModelManager()
+pool   = LlamaServerPool()
 
 class AmalloHandler(BaseHTTPRequestHandler):
     def log_message(self, *args):
@@ -204,6 +406,7 @@ class AmalloHandler(BaseHTTPRequestHandler):
                 'model': models.current,
                 'models_available': models.available(),
                 'disk_free_gb': round(free / 1e9, 1),
+                'llama_servers': pool.status(),
                 'sovereign': True,
                 'operator': info.get('identity') if info else None
             })
@@ -253,9 +456,35 @@ class AmalloHandler(BaseHTTPRequestHandler):
 
             models.switch(body.get('model', 'current'))
             model_path = os.path.join(MODELS_DIR, models.current)
-            text = run_inference(model_path, messages,
-                                 body.get('max_tokens', 2048),
-                                 body.get('temperature', 0.7))
+            if body.get('stream', False):
+                meta = {}
+                stream = run_inference_stream(model_path, messages,
+                                              body.get('max_tokens', 2048),
+                                              body.get('temperature', 0.7), meta)
+                first = next(stream, b'')   # meta is filled once the backend answers
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.send_header('X-Amallo-Engine', meta.get('engine', 'none'))
+                self.send_header('X-Amallo-Cold', str(meta.get('cold', False)).lower())
+                self.send_header('X-Amallo-Startup-Ms', str(meta.get('startup_ms', 0)))
+                self.send_header('X-Amallo-TTFB-Ms', str(meta.get('latency_ms', 0)))
+                self.end_headers()
+                try:
+                    self.wfile.write(first)
+                    for chunk in stream:
+                        self.wfile.write(chunk)
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    stream.close()   # closes the upstream connection too
+                return
+
+            text, meta = run_inference(model_path, messages,
+                                       body.get('max_tokens', 2048),
+                                       body.get('temperature', 0.7))
 
             self.send_json({
                 'id': 'amallo-' + uuid.uuid4().hex[:8],
@@ -267,6 +496,7 @@ class AmalloHandler(BaseHTTPRequestHandler):
                               'finish_reason': 'stop'}],
                 'sovereign': True,
                 'node': 'amallo-node-0',
+                'backend': meta,
                 'operator': info.get('identity') if info else 'unknown'
             })
             return
@@ -2,6 +2,8 @@
 """
 Sovereign GGUF Model Server
 OpenAI-compatible inference server backed by llama-cpp-python.
+Also speaks Ollama's /api/generate, /api/chat and /api/tags on the same
+model pool, so amallo_controller can point OLLAMA_URL here.
 Port 8300 | No auth | ~/.config/amallo/gguf_catalogue.json
 """
 
@@ -27,11 +29,16 @@ from pydantic import BaseModel, Field
 MODELS_DIR = Path.home() / "models" / "gguf"
 CATALOGUE_PATH = Path.home() / ".config" / "amallo" / "gguf_catalogue.json"
 PORT = 8300
+SESSION_TTL = int(os.environ.get("GGUF_SESSION_TTL", "1800"))            # idle seconds
+SESSION_STATE_MB = int(os.environ.get("GGUF_SESSION_STATE_MB", "1024"))  # pinned KV budget
+SESSION_MAX = int(os.environ.get("GGUF_SESSION_MAX", "256"))
 
 # ─── Globals ──────────────────────────────────────────────────────────────────
 _llm = None          # current loaded Llama instance
 _loaded_model = None # name of currently loaded model
-_llm_lock = threading.Lock()
+# One Llama, one KV cache: loading/swapping and every inference hold this lock,
+# and run on the llm returned by _load_model rather than re-reading _llm.
+_infer_lock = threading.RLock()
 
 
 # ─── Catalogue helpers ────────────────────────────────────────────────────────
@@ -90,7 +97,13 @@ def scan_and_populate() -> Dict[str, Any]:
 
 # ─── Model loading ────────────────────────────────────────────────────────────
 
-def _load_model(model_name: str) -> None:
+def _load_model(model_name: str):
+    """Make model_name the loaded model and return (llm, name).
+
+    Takes _infer_lock (reentrant): a caller that goes on to run inference
+    holds the lock across both, so no other request can swap the model
+    in between.
+    """
     global _llm, _loaded_model
 
     try:
@@ -111,9 +124,9 @@ def _load_model(model_name: str) -> None:
     if not model_path.exists():
         raise FileNotFoundError(f"Model file not found: {model_path}")
 
-    with _llm_lock:
+    with _infer_lock:
         if _loaded_model == model_name and _llm is not None:
-            return  # already loaded
+            return _llm, _loaded_model  # already loaded
 
         # Unload previous
         if _llm is not None:
@@ -134,6 +147,220 @@ def _load_model(model_name: str) -> None:
         cat[model_name]["last_used"] = datetime.now(timezone.utc).isoformat()
         save_catalogue(cat)
         print(f"  [gguf] {model_name} ready.", flush=True)
+        return _llm, _loaded_model
+
+
+def _model_or_http(model_name: str):
+    """_load_model for request handlers: load failures become HTTP errors."""
+    try:
+        return _load_model(model_name)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _iter_locked(model_name: str, make_iter):
+    """Run make_iter(llm, name) on a worker thread that holds _infer_lock from
+    model load to the last item, and relay its items without blocking the loop.
+
+    The first item is {"model": name, "load_ns": ...} so a handler can await it
+    (and turn load failures into HTTP errors) before starting a response.
+    Closing this generator (client gone) stops the worker at the next item.
+    """
+    loop = asyncio.get_event_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+
+    def _run():
+        try:
+            with _infer_lock:
+                t = time.perf_counter_ns()
+                llm, name = _model_or_http(model_name)
+                put({"model": name, "load_ns": time.perf_counter_ns() - t})
+                it = make_iter(llm, name)
+                try:
+                    for item in it:
+                        if stop.is_set():
+                            break
+                        put(item)
+                finally:
+                    if hasattr(it, "close"):
+                        it.close()
+        except Exception as e:
+            put(e)
+        finally:
+            put(None)
+
+    threading.Thread(target=_run, daemon=True).start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+# ─── Sessions ─────────────────────────────────────────────────────────────────
+# A session pins its message history plus a snapshot of the llama.cpp KV cache
+# taken after its last turn. The next turn restores the snapshot, so llama.cpp's
+# prefix match only evaluates the new tokens. Snapshots are dropped LRU-first
+# once SESSION_STATE_MB is exceeded; an evicted session simply replays its
+# history on the next turn.
+
+class Session:
+    def __init__(self, model: str, messages: List[Dict[str, str]], ttl: int):
+        self.id = f"sess-{uuid.uuid4().hex[:16]}"
+        self.model = model
+        self.messages = messages
+        self.ttl = ttl
+        self.created = time.time()
+        self.last_used = self.created
+        self.state = None         # llama_cpp.LlamaState after the last turn
+        self.state_model = None   # model the snapshot belongs to
+        self.state_bytes = 0
+        self.n_tokens = 0
+        self.turns = 0
+        self.replays = 0
+
+    def expired(self, now: float) -> bool:
+        return now - self.last_used > self.ttl
+
+    def drop_state(self) -> None:
+        self.state = None
+        self.state_model = None
+        self.state_bytes = 0
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "object": "session",
+            "model": self.model,
+            "messages": len(self.messages),
+            "n_tokens": self.n_tokens,
+            "turns": self.turns,
+            "replays": self.replays,
+            "kv_pinned": self.state is not None,
+            "kv_bytes": self.state_bytes,
+            "created": int(self.created),
+            "expires_at": int(self.last_used + self.ttl),
+        }
+
+
+class SessionStore:
+    def __init__(self, ttl: int, budget_bytes: int, max_sessions: int):
+        self.ttl = ttl
+        self.budget_bytes = budget_bytes
+        self.max_sessions = max_sessions
+        self._sessions: Dict[str, Session] = {}
+        self._lock = threading.Lock()
+
+    def create(self, model: str, messages: List[Dict[str, str]], ttl: Optional[int] = None) -> Session:
+        sess = Session(model, messages, ttl or self.ttl)
+        with self._lock:
+            self._reap()
+            if len(self._sessions) >= self.max_sessions:
+                oldest = min(self._sessions.values(), key=lambda s: s.last_used)
+                del self._sessions[oldest.id]
+            self._sessions[sess.id] = sess
+        return sess
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            self._reap()
+            sess = self._sessions.get(session_id)
+            if sess is not None:
+                sess.last_used = time.time()
+            return sess
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._reap()
+            return [s.info() for s in self._sessions.values()]
+
+    def pinned_bytes(self) -> int:
+        with self._lock:
+            return sum(s.state_bytes for s in self._sessions.values())
+
+    def pin(self, sess: Session, state, model: str) -> None:
+        """Attach a fresh KV snapshot to sess, then evict LRU snapshots over budget."""
+        with self._lock:
+            sess.state = state
+            sess.state_model = model
+            sess.state_bytes = int(getattr(state, "llama_state_size", 0))
+            sess.n_tokens = int(getattr(state, "n_tokens", 0))
+            total = sum(s.state_bytes for s in self._sessions.values())
+            for victim in sorted(self._sessions.values(), key=lambda s: s.last_used):
+                if total <= self.budget_bytes:
+                    break
+                if victim.state is None or victim is sess:
+                    continue
+                total -= victim.state_bytes
+                victim.drop_state()
+            if total > self.budget_bytes:
+                sess.drop_state()
+
+    def _reap(self) -> None:
+        now = time.time()
+        for sid in [sid for sid, s in self._sessions.items() if s.expired(now)]:
+            del self._sessions[sid]
+
+
+_sessions = SessionStore(SESSION_TTL, SESSION_STATE_MB * 1024 * 1024, SESSION_MAX)
+
+
+def _session_generate(llm, name: str, sess: Session, delta: List[Dict[str, str]], req,
+                      stream: bool = False):
+    """Run one session turn on llm (model `name`, from _load_model). Caller
+    must hold _infer_lock for the whole turn, through _session_commit.
+
+    Restores the session's KV snapshot when it belongs to this model,
+    otherwise the full history is replayed. Returns (result, replayed).
+    """
+    replayed = sess.state is None or sess.state_model != name
+    if replayed:
+        sess.replays += 1
+    else:
+        llm.load_state(sess.state)
+    result = llm.create_chat_completion(
+        messages=sess.messages + delta,
+        temperature=req.temperature,
+        max_tokens=req.max_tokens,
+        top_p=req.top_p,
+        stop=req.stop,
+        stream=stream,
+    )
+    return result, replayed
+
+
+def _session_commit(llm, name: str, sess: Session, delta: List[Dict[str, str]], reply: str) -> None:
+    """Append the turn to the session history and pin the resulting KV state."""
+    sess.messages.extend(delta)
+    sess.messages.append({"role": "assistant", "content": reply})
+    sess.turns += 1
+    sess.last_used = time.time()
+    _sessions.pin(sess, llm.save_state(), name)
+
+
+def _session_stream(llm, name: str, sess: Session, delta: List[Dict[str, str]], req, meta):
+    """Streaming session turn for _iter_locked; commits once the stream is drained."""
+    stream, meta["replayed"] = _session_generate(llm, name, sess, delta, req, stream=True)
+    parts = []
+    for chunk in stream:
+        parts.append(chunk["choices"][0].get("delta", {}).get("content") or "")
+        yield chunk
+    _session_commit(llm, name, sess, delta, "".join(parts))
 
 
 # ─── Pydantic models ──────────────────────────────────────────────────────────
@@ -144,13 +371,39 @@ class ChatMessage(BaseModel):
 
 
 class ChatCompletionRequest(BaseModel):
-    model: str
+    model: Optional[str] = None
     messages: List[ChatMessage]
     temperature: float = 0.7
     max_tokens: int = 512
     top_p: float = 0.95
     stream: bool = False
     stop: Optional[List[str]] = None
+    logprobs: bool = Field(False, description="Return per-token logprobs (non-streaming)")
+    session_id: Optional[str] = Field(None, description="Send only new messages; history lives server-side")
+
+
+class SessionCreateRequest(BaseModel):
+    model: str
+    messages: List[ChatMessage] = []
+    ttl: Optional[int] = Field(None, description="Idle seconds before the session expires")
+
+
+class OllamaGenerateRequest(BaseModel):
+    model: str
+    prompt: str = ""
+    system: Optional[str] = None
+    raw: bool = False
+    stream: bool = True           # Ollama streams unless told otherwise
+    options: Dict[str, Any] = {}
+    keep_alive: Optional[Any] = None
+
+
+class OllamaChatRequest(BaseModel):
+    model: str
+    messages: List[ChatMessage]
+    stream: bool = True
+    options: Dict[str, Any] = {}
+    keep_alive: Optional[Any] = None
 
 
 class PullRequest(BaseModel):
@@ -168,9 +421,10 @@ async def lifespan(app: FastAPI):
     yield
     # Cleanup on shutdown
     global _llm
-    if _llm is not None:
-        del _llm
-        _llm = None
+    with _infer_lock:
+        if _llm is not None:
+            del _llm
+            _llm = None
 
 
 app = FastAPI(
@@ -200,6 +454,12 @@ def _print_banner(cat: Dict[str, Any]) -> None:
         "  GET  /health",
         "  GET  /v1/models",
         "  POST /v1/chat/completions",
+        "  POST /v1/sessions",
+        "  GET  /v1/sessions/{id}",
+        "  DELETE /v1/sessions/{id}",
+        "  POST /api/generate   (ollama)",
+        "  POST /api/chat       (ollama)",
+        "  GET  /api/tags       (ollama)",
         "  POST /gguf/pull",
         "  GET  /gguf/catalogue",
         "  DELETE /gguf/unload",
@@ -218,6 +478,8 @@ async def health():
         "status": "ok",
         "loaded_model": _loaded_model,
         "catalogue_size": len(load_catalogue()),
+        "sessions": len(_sessions.list()),
+        "sessions_kv_bytes": _sessions.pinned_bytes(),
         "models_dir": str(MODELS_DIR),
         "timestamp": datetime.now(timezone.utc).isoformat(),
     }
@@ -248,34 +510,45 @@ async def list_models():
 
 @app.post("/v1/chat/completions")
 async def chat_completions(req: ChatCompletionRequest):
-    # Load model (swap if needed) in thread pool to avoid blocking event loop
-    try:
-        await asyncio.get_event_loop().run_in_executor(None, _load_model, req.model)
-    except (ValueError, FileNotFoundError) as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except RuntimeError as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    if req.session_id:
+        return await _session_chat(req)
+    if not req.model:
+        raise HTTPException(status_code=400, detail="model is required without session_id")
 
     messages = [{"role": m.role, "content": m.content} for m in req.messages]
 
     if req.stream:
+        gen = _iter_locked(req.model, lambda llm, name: llm.create_chat_completion(
+            messages=messages,
+            temperature=req.temperature,
+            max_tokens=req.max_tokens,
+            top_p=req.top_p,
+            stop=req.stop,
+            stream=True,
+        ))
+        head = await _first(gen)
         return StreamingResponse(
-            _stream_chat(messages, req),
+            _stream_chat(gen, head["model"]),
             media_type="text/event-stream",
         )
 
-    # Blocking inference — run in thread pool
-    try:
-        result = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: _llm.create_chat_completion(
+    # Load (swap if needed) and infer under one lock, in the thread pool
+    def _run():
+        with _infer_lock:
+            llm, name = _model_or_http(req.model)
+            return llm.create_chat_completion(
                 messages=messages,
                 temperature=req.temperature,
                 max_tokens=req.max_tokens,
                 top_p=req.top_p,
                 stop=req.stop,
-            ),
-        )
+                logprobs=req.logprobs,
+            ), name
+
+    try:
+        result, model = await asyncio.get_event_loop().run_in_executor(None, _run)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Inference error: {e}")
 
@@ -286,7 +559,7 @@ async def chat_completions(req: ChatCompletionRequest):
         "id": completion_id,
         "object": "chat.completion",
         "created": int(time.time()),
-        "model": _loaded_model,
+        "model": model,
         "choices": [
             {
                 "index": 0,
@@ -295,46 +568,35 @@ async def chat_completions(req: ChatCompletionRequest):
                     "content": choice["message"]["content"],
                 },
                 "finish_reason": choice.get("finish_reason", "stop"),
+                **({"logprobs": choice.get("logprobs")} if req.logprobs else {}),
             }
         ],
         "usage": result.get("usage", {}),
     }
 
 
-async def _stream_chat(messages, req: ChatCompletionRequest):
-    """Server-sent events streaming generator."""
-    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
-    loop = asyncio.get_event_loop()
-    queue: asyncio.Queue = asyncio.Queue()
+async def _first(gen):
+    """Await _iter_locked's load item; load or lock failures surface as HTTP errors."""
+    try:
+        return await gen.__anext__()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Inference error: {e}")
 
-    def _run_inference():
-        try:
-            for chunk in _llm.create_chat_completion(
-                messages=messages,
-                temperature=req.temperature,
-                max_tokens=req.max_tokens,
-                top_p=req.top_p,
-                stop=req.stop,
-                stream=True,
-            ):
-                asyncio.run_coroutine_threadsafe(queue.put(chunk), loop)
-        finally:
-            asyncio.run_coroutine_threadsafe(queue.put(None), loop)
 
-    thread = threading.Thread(target=_run_inference, daemon=True)
-    thread.start()
+async def _stream_chat(gen, model: str):
+    """Server-sent events streaming generator over an _iter_locked chat stream."""
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
 
-    while True:
-        chunk = await queue.get()
-        if chunk is None:
-            break
+    async for chunk in gen:
         delta = chunk["choices"][0].get("delta", {})
         finish_reason = chunk["choices"][0].get("finish_reason")
         payload = {
             "id": completion_id,
             "object": "chat.completion.chunk",
             "created": int(time.time()),
-            "model": _loaded_model,
+            "model": model,
             "choices": [
                 {
                     "index": 0,
@@ -348,6 +610,297 @@ async def _stream_chat(messages, req: ChatCompletionRequest):
     yield "data: [DONE]\n\n"
 
 
+# ─── /v1/sessions ─────────────────────────────────────────────────────────────
+
+@app.post("/v1/sessions")
+async def create_session(req: SessionCreateRequest):
+    sess = _sessions.create(
+        req.model,
+        [{"role": m.role, "content": m.content} for m in req.messages],
+        req.ttl,
+    )
+    return sess.info()
+
+
+@app.get("/v1/sessions")
+async def list_sessions():
+    return {"object": "list", "data": _sessions.list()}
+
+
+@app.get("/v1/sessions/{session_id}")
+async def get_session(session_id: str):
+    sess = _sessions.get(session_id)
+    if sess is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found or expired.")
+    return {**sess.info(), "history": sess.messages}
+
+
+@app.delete("/v1/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if not _sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found or expired.")
+    return {"status": "deleted", "id": session_id}
+
+
+async def _session_chat(req: ChatCompletionRequest):
+    sess = _sessions.get(req.session_id)
+    if sess is None:
+        raise HTTPException(status_code=404, detail=f"Session '{req.session_id}' not found or expired.")
+    delta = [{"role": m.role, "content": m.content} for m in req.messages]
+
+    if req.stream:
+        meta: Dict[str, Any] = {}
+        gen = _iter_locked(sess.model,
+                           lambda llm, name: _session_stream(llm, name, sess, delta, req, meta))
+        head = await _first(gen)
+        return StreamingResponse(
+            _stream_session_chat(gen, head["model"], sess, meta),
+            media_type="text/event-stream",
+        )
+
+    # Load, restore → generate → snapshot, all on one llm under one lock
+    def _turn():
+        with _infer_lock:
+            llm, name = _model_or_http(sess.model)
+            result, replayed = _session_generate(llm, name, sess, delta, req)
+            _session_commit(llm, name, sess, delta, result["choices"][0]["message"]["content"] or "")
+            return result, replayed, name
+
+    try:
+        result, replayed, model = await asyncio.get_event_loop().run_in_executor(None, _turn)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Inference error: {e}")
+
+    choice = result["choices"][0]
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": choice["message"]["content"],
+                },
+                "finish_reason": choice.get("finish_reason", "stop"),
+            }
+        ],
+        "usage": result.get("usage", {}),
+        "session": {**sess.info(), "replayed": replayed},
+    }
+
+
+async def _stream_session_chat(gen, model: str, sess: Session, meta: Dict[str, Any]):
+    """SSE generator for a session turn; the turn is committed once the stream ends."""
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+    try:
+        async for chunk in gen:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": chunk["choices"][0].get("delta", {}),
+                        "finish_reason": chunk["choices"][0].get("finish_reason"),
+                    }
+                ],
+            }
+            yield f"data: {json.dumps(payload)}\n\n"
+    except Exception as e:
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+
+    yield f"data: {json.dumps({'session': {**sess.info(), 'replayed': meta.get('replayed', True)}})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+# ─── Ollama-compatible surface ────────────────────────────────────────────────
+# Same model pool as /v1/*. Durations are nanoseconds, as Ollama reports them.
+
+def _ollama_name(model: str) -> str:
+    """Ollama clients send 'name:tag'; the catalogue is keyed by filename."""
+    return model[:-len(":latest")] if model.endswith(":latest") else model
+
+
+def _ollama_sampling(options: Dict[str, Any]) -> Dict[str, Any]:
+    kwargs = {
+        "temperature": options.get("temperature", 0.7),
+        "max_tokens": options.get("num_predict", 512),
+        "top_p": options.get("top_p", 0.95),
+        "stop": options.get("stop"),
+    }
+    if kwargs["max_tokens"] is not None and kwargs["max_tokens"] < 0:
+        kwargs["max_tokens"] = None   # num_predict -1 = until EOS
+    if "top_k" in options:
+        kwargs["top_k"] = options["top_k"]
+    if "repeat_penalty" in options:
+        kwargs["repeat_penalty"] = options["repeat_penalty"]
+    if "seed" in options:
+        kwargs["seed"] = options["seed"]
+    return kwargs
+
+
+def _ollama_now() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _ollama_final(t0: int, load_ns: int, usage: Dict[str, Any], done_reason: Optional[str]) -> Dict[str, Any]:
+    return {
+        "done": True,
+        "done_reason": done_reason or "stop",
+        "total_duration": time.perf_counter_ns() - t0,
+        "load_duration": load_ns,
+        "prompt_eval_count": usage.get("prompt_tokens", 0),
+        "eval_count": usage.get("completion_tokens", 0),
+    }
+
+
+def _ollama_call(model: str, make):
+    """Load model and, if make is given, run make(llm, False), all under _infer_lock.
+
+    Returns (result, name, load_ns).
+    """
+    with _infer_lock:
+        t = time.perf_counter_ns()
+        llm, name = _model_or_http(_ollama_name(model))
+        load_ns = time.perf_counter_ns() - t
+        return (make(llm, False) if make else None), name, load_ns
+
+
+def _with_usage(llm, stream):
+    """Pass a llama.cpp stream through, then yield {"usage": ...} with the real
+    prompt/completion token counts a non-stream result carries. Runs on the
+    _iter_locked worker, so llm is still ours when it counts."""
+    prompt, parts = None, []
+    for chunk in stream:
+        if prompt is None:
+            prompt = llm.n_tokens  # prompt evaluated, first sampled token not yet
+        choice = chunk["choices"][0]
+        parts.append(choice.get("text") or choice.get("delta", {}).get("content") or "")
+        yield chunk
+    text = "".join(parts)
+    yield {"usage": {
+        "prompt_tokens": prompt or 0,
+        "completion_tokens": len(llm.tokenize(text.encode(), add_bos=False)) if text else 0,
+    }}
+
+
+async def _ollama_stream(model: str, make, field: str, t0: int):
+    gen = _iter_locked(_ollama_name(model), lambda llm, name: _with_usage(llm, make(llm, True)))
+    head = await _first(gen)
+    return StreamingResponse(_ollama_ndjson(gen, head, field, t0),
+                             media_type="application/x-ndjson")
+
+
+async def _ollama_ndjson(gen, head: Dict[str, Any], field: str, t0: int):
+    """Re-frame an _iter_locked stream (completion or chat chunks) as Ollama NDJSON lines.
+
+    field is "response" for /api/generate and "message" for /api/chat.
+    """
+    model = head["model"]
+    usage: Dict[str, Any] = {}
+    done_reason = None
+    try:
+        async for chunk in gen:
+            if "usage" in chunk:
+                usage = chunk["usage"]
+                continue
+            choice = chunk["choices"][0]
+            text = choice.get("text") or choice.get("delta", {}).get("content")
+            done_reason = choice.get("finish_reason") or done_reason
+            if not text:
+                continue
+            body = text if field == "response" else {"role": "assistant", "content": text}
+            yield json.dumps({"model": model, "created_at": _ollama_now(), field: body, "done": False}) + "\n"
+    except Exception as e:
+        yield json.dumps({"error": f"Inference error: {e}"}) + "\n"
+        return
+    last = {"model": model, "created_at": _ollama_now(),
+            field: "" if field == "response" else {"role": "assistant", "content": ""}}
+    last.update(_ollama_final(t0, head["load_ns"], usage, done_reason))
+    yield json.dumps(last) + "\n"
+
+
+@app.get("/api/tags")
+async def ollama_tags():
+    cat = load_catalogue()
+    return {
+        "models": [
+            {
+                "name": name,
+                "model": name,
+                "modified_at": entry.get("last_used") or entry.get("added_at"),
+                "size": entry.get("size", 0),
+                "digest": "",
+                "details": {"format": "gguf", "family": "", "parameter_size": "", "quantization_level": ""},
+            }
+            for name, entry in cat.items()
+        ]
+    }
+
+
+@app.post("/api/generate")
+async def ollama_generate(req: OllamaGenerateRequest):
+    t0 = time.perf_counter_ns()
+    kwargs = _ollama_sampling(req.options)
+
+    if req.raw:
+        make = lambda llm, stream: llm.create_completion(prompt=req.prompt, stream=stream, **kwargs)
+    else:
+        messages = ([{"role": "system", "content": req.system}] if req.system else []) + \
+                   [{"role": "user", "content": req.prompt}]
+        make = lambda llm, stream: llm.create_chat_completion(messages=messages, stream=stream, **kwargs)
+
+    if req.stream and req.prompt:
+        return await _ollama_stream(req.model, make, "response", t0)
+
+    # Ollama treats an empty prompt as "just load the model"
+    try:
+        result, name, load_ns = await asyncio.get_event_loop().run_in_executor(
+            None, _ollama_call, req.model, make if req.prompt else None)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Inference error: {e}")
+    if result is None:
+        return {"model": name, "created_at": _ollama_now(), "response": "",
+                **_ollama_final(t0, load_ns, {}, "load")}
+    choice = result["choices"][0]
+    text = choice["text"] if req.raw else choice["message"]["content"]
+    return {"model": name, "created_at": _ollama_now(), "response": text,
+            **_ollama_final(t0, load_ns, result.get("usage", {}), choice.get("finish_reason"))}
+
+
+@app.post("/api/chat")
+async def ollama_chat(req: OllamaChatRequest):
+    t0 = time.perf_counter_ns()
+    kwargs = _ollama_sampling(req.options)
+    messages = [{"role": m.role, "content": m.content} for m in req.messages]
+    make = lambda llm, stream: llm.create_chat_completion(messages=messages, stream=stream, **kwargs)
+
+    if req.stream:
+        return await _ollama_stream(req.model, make, "message", t0)
+
+    try:
+        result, name, load_ns = await asyncio.get_event_loop().run_in_executor(
+            None, _ollama_call, req.model, make)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Inference error: {e}")
+    choice = result["choices"][0]
+    return {"model": name, "created_at": _ollama_now(),
+            "message": {"role": "assistant", "content": choice["message"]["content"]},
+            **_ollama_final(t0, load_ns, result.get("usage", {}), choice.get("finish_reason"))}
+
+
 # ─── /gguf/pull ───────────────────────────────────────────────────────────────
 
 @app.post("/gguf/pull")
@@ -438,14 +991,19 @@ async def get_catalogue():
 
 @app.delete("/gguf/unload")
 async def unload_model():
-    global _llm, _loaded_model
-    with _llm_lock:
-        if _llm is None:
-            return {"status": "no_model_loaded"}
-        name = _loaded_model
-        del _llm
-        _llm = None
-        _loaded_model = None
+    def _unload():
+        global _llm, _loaded_model
+        with _infer_lock:  # waits out any in-flight inference
+            name = _loaded_model
+            if _llm is not None:
+                del _llm
+                _llm = None
+                _loaded_model = None
+            return name
+
+    name = await asyncio.get_event_loop().run_in_executor(None, _unload)
+    if name is None:
+        return {"status": "no_model_loaded"}
     return {"status": "unloaded", "model": name}
 
 
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+brain-intent — train, evaluate and time amallo-brain's intent classifier
+
+  train    fit the hashed n-gram fallback on logged prompts in brain.db
+           (labels: rows the regex pass resolved on its own, plus any
+           --labels corrections) and write intent_model.json
+  report   accuracy on a held-out fifth of the logged rows (and on --labels
+           if given) for the legacy first-match loop, the compiled regex
+           pass alone, and regex + learned fallback; plus how often the
+           regex pass is ambiguous or misses
+  bench    µs per classification: legacy loop vs precompiled patterns vs
+           compiled + model, over logged prompts (or a built-in sample)
+
+Prompts are only logged when amallo-brain runs with BRAIN_LOG_PROMPT_CHARS
+set (e.g. 2000); it is 0 by default, and then there is nothing to train on.
+
+--labels is JSONL of {"prompt": ..., "intent": ...}, hand-checked routes that
+override whatever the regex said. Without it every label comes from the regex
+pass itself, so the model can only relearn the regexes (it still helps with
+ambiguous prompts, but won't fix a route the regexes get wrong): pass --labels
+for a fallback that knows better than the patterns.
+
+Usage:
+  python3 tools/brain-intent.py train
+  python3 tools/brain-intent.py report --labels corrections.jsonl
+  python3 tools/brain-intent.py bench --n 20000
+"""
+
+import os, sys, json, math, time, random, sqlite3, argparse, importlib.util
+from importlib.machinery import SourceFileLoader
+
+BRAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "amallo-brain")
+_loader = SourceFileLoader("amallo_brain", BRAIN)
+brain = importlib.util.module_from_spec(importlib.util.spec_from_loader("amallo_brain", _loader))
+_loader.exec_module(brain)
+
+SAMPLE = [
+    "refactor this function to use a dict", "write a python script that renames files",
+    "what is the capital of peru", "solve 3x + 7 = 22", "explain how a b-tree splits step by step",
+    "write a haiku about the mesh", "<|fim_prefix|>def add(a, b):<|fim_suffix|>", "hey",
+    "compare and contrast raft and paxos", "how many ways can 5 people sit at a round table",
+    "I have been thinking about moving the garden beds closer to the house this spring, thoughts?",
+    "implement an lru cache in rust", "clean up this bash loop", "define entropy",
+]
+NO_MODEL = {"dim": 1, "classes": [], "w": {}, "b": []}   # regex pass alone
+
+
+def legacy_classify(prompt):
+    """The pre-compiled classifier: first re.search hit in PATTERNS order wins."""
+    p = prompt.lower()
+    for intent, backend, model_hint, patterns in brain.PATTERNS:
+        for pat in patterns:
+            if brain.re.search(pat, p, brain.re.IGNORECASE):
+                return intent
+    return "chat"
+
+
+def load_rows(db):
+    con = sqlite3.connect(db)
+    cols = {r[1] for r in con.execute("PRAGMA table_info(routes)")}
+    if "prompt" not in cols:
+        return []
+    rows = con.execute("SELECT id, prompt, intent, source FROM routes "
+                       "WHERE prompt IS NOT NULL AND prompt != '' ORDER BY ts").fetchall()
+    con.close()
+    return rows
+
+
+def load_labels(path):
+    if not path:
+        return {}
+    with open(path) as f:
+        return {d["prompt"]: d["intent"] for d in map(json.loads, filter(str.strip, f))}
+
+
+def training_set(rows, labels):
+    """(prompt, intent) pairs: hand labels first, then rows the regex pass
+    resolved alone, with misses as "chat" so the model learns when to leave
+    them there (re-derived, so rows logged before the source column count too).
+    Ambiguous rows are what the model is for; they never train it."""
+    out = dict(labels)
+    for _, prompt, intent, source in rows:
+        if prompt in out:
+            continue
+        hits = brain.match_intents(prompt)
+        if len(hits) <= 1:
+            out[prompt] = next(iter(hits), "chat")
+    return list(out.items())
+
+
+def train(samples, dim=brain.NGRAM_DIM, epochs=8, lr=0.3, l2=1e-5, seed=369):
+    """Multinomial logistic regression by SGD on hashed features."""
+    classes = sorted({y for _, y in samples})
+    w = {c: {} for c in classes}
+    b = {c: 0.0 for c in classes}
+    data = [(brain.ngram_features(x, dim), y) for x, y in samples]
+    rng = random.Random(seed)
+    for epoch in range(epochs):
+        rng.shuffle(data)
+        step = lr / (1 + epoch)
+        for feats, y in data:
+            scores = {c: b[c] + sum(w[c].get(f, 0.0) for f in feats) for c in classes}
+            top = max(scores.values())
+            exp = {c: math.exp(v - top) for c, v in scores.items()}
+            z = sum(exp.values())
+            for c in classes:
+                g = exp[c] / z - (c == y)
+                if abs(g) < 1e-4:
+                    continue
+                wc = w[c]
+                for f in feats:
+                    wc[f] = wc.get(f, 0.0) * (1 - l2) - step * g
+                b[c] -= step * g
+    rows = {}
+    for i, c in enumerate(classes):
+        for f, v in w[c].items():
+            if abs(v) > 1e-4:
+                rows.setdefault(f, [0.0] * len(classes))[i] = round(v, 5)
+    return {"dim": dim, "classes": classes, "w": rows, "b": [b[c] for c in classes],
+            "trained": time.strftime("%Y-%m-%dT%H:%M:%SZ"), "samples": len(samples)}
+
+
+def holdout(pairs):
+    """Deterministic split: every fifth sample is held out."""
+    return ([p for i, p in enumerate(pairs) if i % 5],
+            [p for i, p in enumerate(pairs) if not i % 5])
+
+
+def accuracy(pairs, fn):
+    return sum(fn(x) == y for x, y in pairs) / len(pairs) if pairs else float("nan")
+
+
+def cmd_train(args):
+    pairs = training_set(load_rows(args.db), load_labels(args.labels))
+    if len(pairs) < 10:
+        print(f"only {len(pairs)} labelled prompts in {args.db}; route more traffic first "
+              "(with BRAIN_LOG_PROMPT_CHARS set)")
+        return 1
+    if not args.labels:
+        print("no --labels: training on the regex pass's own labels only")
+    model = train(pairs, epochs=args.epochs)
+    with open(args.out, "w") as f:
+        json.dump(model, f)
+    counts = {}
+    for _, y in pairs:
+        counts[y] = counts.get(y, 0) + 1
+    print(f"trained on {len(pairs)} prompts → {args.out} "
+          f"({len(model['w'])} features × {len(model['classes'])} classes)")
+    print("  " + "  ".join(f"{c}:{n}" for c, n in sorted(counts.items(), key=lambda kv: -kv[1])))
+    print("restart amallo-brain to pick it up")
+
+
+def cmd_report(args):
+    rows, labels = load_rows(args.db), load_labels(args.labels)
+    pairs = training_set(rows, {})
+    train_set, test_set = holdout(pairs)
+    model = train(train_set + list(labels.items()), epochs=args.epochs) if train_set else None
+
+    print(f"\n{len(rows)} logged prompts, {len(pairs)} regex-labelled, {len(labels)} hand-labelled\n")
+    sources = {}
+    for _, prompt, _, _ in rows:
+        s = brain.resolve_intent(prompt, model or NO_MODEL)[1]
+        sources[s] = sources.get(s, 0) + 1
+    if rows:
+        print("regex pass on logged prompts: " + ", ".join(
+            f"{s} {n / len(rows):.1%}" for s, n in sorted(sources.items(), key=lambda kv: -kv[1])))
+
+    def full(x):
+        return brain.resolve_intent(x, model)[0]
+
+    def regex_only(x):
+        return brain.resolve_intent(x, NO_MODEL)[0]
+
+    def model_only(x):
+        return brain.predict_intent(model, x)[0]
+
+    suites = [("held-out regex labels", test_set)]
+    if labels:
+        suites.append(("hand labels", list(labels.items())))
+    print(f"\n{'':24} {'n':>6} {'legacy':>8} {'regex':>8} {'model':>8} {'regex+model':>12}")
+    for name, data in suites:
+        print(f"{name:24} {len(data):>6} {accuracy(data, legacy_classify):>8.1%} "
+              f"{accuracy(data, regex_only):>8.1%} "
+              f"{accuracy(data, model_only) if model else float('nan'):>8.1%} "
+              f"{accuracy(data, full) if model else float('nan'):>12.1%}")
+    if labels:
+        print("\n  hand-label disagreements (legacy → labelled):")
+        for x, y in list(labels.items())[:args.show]:
+            if legacy_classify(x) != y:
+                print(f"    {legacy_classify(x):>10} → {y:<10} {x[:60]!r}")
+
+
+def cmd_bench(args):
+    prompts = (os.path.exists(args.db) and [r[1] for r in load_rows(args.db)]) or SAMPLE
+    model = brain.load_intent_model(args.model) if os.path.exists(args.model) else None
+    work = [prompts[i % len(prompts)] for i in range(args.n)]
+    fns = [("legacy loop", legacy_classify),
+           ("compiled patterns", lambda x: brain.resolve_intent(x, NO_MODEL))]
+    if model:
+        fns.append(("compiled + model", lambda x: brain.resolve_intent(x, model)))
+    print(f"\n{args.n} classifications over {len(prompts)} distinct prompts"
+          f"{'' if model else ' (no trained model; run train first to time the fallback)'}\n")
+    base = None
+    for name, fn in fns:
+        t0 = time.perf_counter()
+        for x in work:
+            fn(x)
+        us = (time.perf_counter() - t0) / args.n * 1e6
+        base = base or us
+        print(f"  {name:18} {us:>8.2f} µs/call  {base / us:>5.2f}x")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="amallo-brain intent classifier tooling")
+    ap.add_argument("cmd", choices=("train", "report", "bench"))
+    ap.add_argument("--db", default=str(brain.DB))
+    ap.add_argument("--labels", help="JSONL of {prompt, intent} corrections")
+    ap.add_argument("--out", default=str(brain.INTENT_MODEL))
+    ap.add_argument("--model", default=str(brain.INTENT_MODEL), help="model to time in bench")
+    ap.add_argument("--epochs", type=int, default=8)
+    ap.add_argument("--n", type=int, default=10000, help="bench iterations")
+    ap.add_argument("--show", type=int, default=20)
+    args = ap.parse_args()
+    if args.cmd != "bench" and not os.path.exists(args.db):
+        print(f"no {args.db}; run amallo-brain and route some traffic first")
+        return 1
+    return {"train": cmd_train, "report": cmd_report, "bench": cmd_bench}[args.cmd](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
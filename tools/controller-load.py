@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+controller-load — concurrency check for amallo_controller.py
+
+Opens N streaming /v1/chat/completions requests at once and probes /health
+in a tight loop while they run. On a concurrent core every stream's TTFT is
+independent of the others and /health stays in the low milliseconds; on the
+old single-threaded HTTPServer streams finish one after another and /health
+waits behind them.
+
+Usage:
+  python3 tools/controller-load.py                       # 4 streams, :8200
+  python3 tools/controller-load.py --streams 8 --url http://127.0.0.1:8200
+  python3 tools/controller-load.py --key sovXXXX --model llama3.2
+"""
+
+import sys, json, time, argparse, threading, statistics, urllib.request
+from pathlib import Path
+
+
+def _key(arg):
+    if arg:
+        return arg
+    f = Path.home() / ".config/amallo/key"
+    return f.read_text().strip() if f.exists() else ""
+
+
+def stream_once(base, key, model, prompt, max_tokens, out):
+    body = json.dumps({"model": model, "stream": True, "max_tokens": max_tokens,
+                       "use_memory": False,
+                       "messages": [{"role": "user", "content": prompt}]}).encode()
+    req = urllib.request.Request(f"{base}/v1/chat/completions", data=body, method="POST")
+    req.add_header("Content-Type", "application/json")
+    req.add_header("Authorization", f"Bearer {key}")
+    t0 = time.perf_counter()
+    ttft, tokens = None, 0
+    try:
+        with urllib.request.urlopen(req, timeout=600) as r:
+            for raw in r:
+                line = raw.decode("utf-8", errors="replace").strip()
+                if not line.startswith("data:") or "[DONE]" in line:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - t0
+                tokens += 1
+        out.append({"start": t0, "ttft": ttft, "total": time.perf_counter() - t0, "tokens": tokens})
+    except Exception as e:
+        out.append({"start": t0, "error": str(e)})
+
+
+def probe_health(base, stop, out):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            urllib.request.urlopen(f"{base}/health", timeout=60).read()
+            out.append(time.perf_counter() - t0)
+        except Exception:
+            out.append(float("inf"))
+        time.sleep(0.05)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="amallo_controller concurrency load test")
+    ap.add_argument("--url", default="http://127.0.0.1:8200")
+    ap.add_argument("--key", default="")
+    ap.add_argument("--model", default="dolphin-mistral")
+    ap.add_argument("--streams", type=int, default=4)
+    ap.add_argument("--max-tokens", type=int, default=128)
+    ap.add_argument("--prompt", default="Count slowly from one to forty in words.")
+    args = ap.parse_args()
+    base, key = args.url.rstrip("/"), _key(args.key)
+
+    streams, health, stop = [], [], threading.Event()
+    prober = threading.Thread(target=probe_health, args=(base, stop, health), daemon=True)
+    prober.start()
+    t0 = time.perf_counter()
+    workers = [threading.Thread(target=stream_once,
+                                args=(base, key, args.model, args.prompt, args.max_tokens, streams))
+               for _ in range(args.streams)]
+    for w in workers: w.start()
+    for w in workers: w.join()
+    wall = time.perf_counter() - t0
+    stop.set(); prober.join()
+
+    print(f"\n{args.streams} concurrent streams, wall {wall:.2f}s\n")
+    print(f"{'#':>3} {'start+':>8} {'ttft':>8} {'total':>8} {'tokens':>7}")
+    for i, s in enumerate(sorted(streams, key=lambda s: s["start"])):
+        if "error" in s:
+            print(f"{i:>3} ERROR {s['error']}")
+            continue
+        print(f"{i:>3} {(s['start']-t0)*1000:7.0f}ms {(s['ttft'] or 0)*1000:7.0f}ms "
+              f"{s['total']*1000:7.0f}ms {s['tokens']:>7}")
+    ok = [s for s in streams if "error" not in s]
+    if ok:
+        serial = sum(s["total"] for s in ok)
+        print(f"\n  sum of stream totals {serial:.2f}s vs wall {wall:.2f}s "
+              f"(overlap x{serial / wall:.1f})")
+    finite = sorted(h for h in health if h != float("inf"))
+    if finite:
+        print(f"  /health during load: n={len(health)} p50={statistics.median(finite)*1000:.1f}ms "
+              f"max={finite[-1]*1000:.1f}ms failures={len(health) - len(finite)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+gguf-bench — latency parity check for gguf_server.py
+
+Fires the same prompt at the native OpenAI endpoint and at the Ollama-compatible
+endpoints on the same server, and prints total latency and time-to-first-token
+for each. The Ollama surface shares the model pool, so the columns should match
+within noise — anything bigger means the re-framing layer is costing us.
+
+Usage:
+  python3 tools/gguf-bench.py MODEL                  # default :8300, 10 runs
+  python3 tools/gguf-bench.py MODEL --runs 30 --url http://127.0.0.1:8300
+  python3 tools/gguf-bench.py MODEL --max-tokens 64 --prompt "Name three rivers."
+"""
+
+import sys, json, time, argparse, statistics, urllib.request
+
+PROMPT = "In one sentence, what is a sovereign AI stack?"
+
+
+def _post(url, payload):
+    req = urllib.request.Request(url, data=json.dumps(payload).encode(), method="POST")
+    req.add_header("Content-Type", "application/json")
+    return urllib.request.urlopen(req, timeout=600)
+
+
+def _time_call(url, payload):
+    """Return (ttft_s, total_s). ttft is measured on the first non-empty token line."""
+    t0 = time.perf_counter()
+    ttft = None
+    with _post(url, payload) as r:
+        for raw in r:
+            line = raw.decode("utf-8", errors="replace").strip()
+            if not line:
+                continue
+            if ttft is None and _has_token(line):
+                ttft = time.perf_counter() - t0
+    total = time.perf_counter() - t0
+    return (ttft if ttft is not None else total), total
+
+
+def _has_token(line):
+    if line.startswith("data:"):
+        line = line[5:].strip()
+        if line == "[DONE]":
+            return False
+    try:
+        d = json.loads(line)
+    except ValueError:
+        return False
+    if "choices" in d:
+        c = d["choices"][0]
+        return bool(c.get("delta", {}).get("content") or c.get("message", {}).get("content"))
+    return bool(d.get("response") or d.get("message", {}).get("content"))
+
+
+def _cases(base, model, prompt, max_tokens):
+    msgs = [{"role": "user", "content": prompt}]
+    opts = {"num_predict": max_tokens, "temperature": 0}
+    return [
+        ("native  /v1/chat/completions", f"{base}/v1/chat/completions",
+         lambda s: {"model": model, "messages": msgs, "max_tokens": max_tokens,
+                    "temperature": 0, "stream": s}),
+        ("ollama  /api/chat", f"{base}/api/chat",
+         lambda s: {"model": model, "messages": msgs, "options": opts, "stream": s}),
+        ("ollama  /api/generate", f"{base}/api/generate",
+         lambda s: {"model": model, "prompt": prompt, "options": opts, "stream": s}),
+    ]
+
+
+def _pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="gguf_server native vs Ollama-surface latency")
+    ap.add_argument("model")
+    ap.add_argument("--url", default="http://127.0.0.1:8300")
+    ap.add_argument("--runs", type=int, default=10)
+    ap.add_argument("--max-tokens", type=int, default=32)
+    ap.add_argument("--prompt", default=PROMPT)
+    args = ap.parse_args()
+
+    cases = _cases(args.url.rstrip("/"), args.model, args.prompt, args.max_tokens)
+
+    # Warm-up: load the model once so nobody's column pays the cold load
+    _time_call(cases[0][1], cases[0][2](False))
+
+    results = {name: {"total": [], "ttft": []} for name, _, _ in cases}
+    for _ in range(args.runs):
+        # Interleave endpoints so drift (thermal, page cache) hits all of them equally
+        for name, url, payload in cases:
+            _, total = _time_call(url, payload(False))
+            ttft, _ = _time_call(url, payload(True))
+            results[name]["total"].append(total)
+            results[name]["ttft"].append(ttft)
+
+    print(f"\nmodel={args.model} runs={args.runs} max_tokens={args.max_tokens}\n")
+    print(f"{'endpoint':32} {'total p50':>10} {'total p95':>10} {'ttft p50':>10} {'ttft p95':>10}")
+    base_total = statistics.median(results[cases[0][0]]["total"])
+    for name, _, _ in cases:
+        r = results[name]
+        print(f"{name:32} {statistics.median(r['total'])*1000:9.0f}ms {_pct(r['total'], 95)*1000:9.0f}ms "
+              f"{statistics.median(r['ttft'])*1000:9.0f}ms {_pct(r['ttft'], 95)*1000:9.0f}ms")
+    print()
+    for name, _, _ in cases[1:]:
+        delta = statistics.median(results[name]["total"]) - base_total
+        print(f"  {name}: {delta*1000:+.0f}ms vs native (p50 total)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
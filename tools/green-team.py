@@ -55,7 +55,8 @@ if "--level" in sys.argv:
     if idx + 1 < len(sys.argv):
         LEVEL_FILTER = int(sys.argv[idx + 1])
 
-HEADERS = {"Authorization": f"Bearer {TOKEN}", "Content-Type": "application/json"}
+HEADERS = {"Authorization": f"Bearer {TOKEN}", "Content-Type": "application/json",
+           "X-Amallo-Lane": "batch"}   # sweeps yield to interactive traffic
 
 # ── Colors ────────────────────────────────────────────────────────────
 def c(code, t): return f"\033[{code}m{t}\033[0m"
@@ -602,7 +603,8 @@ AUTO_FIX = "--fix" in sys.argv
 
 HEADERS = {
     "Authorization": f"Bearer {TOKEN}",
-    "Content-Type":  "application/json"
+    "Content-Type":  "application/json",
+    "X-Amallo-Lane": "batch",
 }
 
 # ── Test suite ────────────────────────────────────────────────────────
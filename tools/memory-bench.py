@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+memory-bench — shared-memory injection, last-20 vs relevance recall
+
+Seeds a throwaway memory store with a long multi-topic history, then builds the
+context for a set of shallow requests two ways:
+
+  recent   the old policy: the last 20 memory messages, verbatim
+  recall   recall_context(): top-k relevant archived snippets + the last two turns
+
+and prints injected tokens (estimated, and Ollama's prompt_eval_count) plus
+end-to-end latency for each. --dry skips Ollama and reports selection only.
+
+Usage:
+  python3 tools/memory-bench.py --dry                    # no model needed
+  python3 tools/memory-bench.py                          # dolphin-mistral on :11434
+  python3 tools/memory-bench.py --model llama3.2 --history 600 --url http://127.0.0.1:11434
+"""
+
+import os, sys, json, time, random, argparse, tempfile, pathlib, statistics, urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import amallo_controller as ctl
+
+TOPICS = {
+    "mesh":    ["the mesh router picks the node with the lowest ttfb",
+                "node {n} dropped off the mesh again after the reboot",
+                "pin session affinity to node {n} for the long chats"],
+    "models":  ["pull the {n}b quant of qwen coder tonight",
+                "dolphin-mistral keeps the persona better than glm4",
+                "the gguf server needs the {n}k context build"],
+    "garden":  ["the tomatoes on the south bed need staking by day {n}",
+                "compost pile hit {n} degrees this morning",
+                "plant garlic before the first frost"],
+    "cymatic": ["the 369 pattern showed up again at {n} hz",
+                "sand plate geometry at {n} hz looks like a hexagram",
+                "record the cymatic run with the new mic"],
+    "ssh":     ["the ssh relay tunnel to the laptop held for {n} minutes",
+                "paramiko channel open costs one round trip",
+                "rotate the relay key on node {n}"],
+}
+QUERIES = [
+    ("mesh",    "Which node should the mesh router prefer right now?"),
+    ("garden",  "When do I need to stake the tomatoes?"),
+    ("cymatic", "What frequency gave the hexagram on the sand plate?"),
+    ("models",  "Which quant of qwen coder was I going to pull?"),
+    ("ssh",     "How long did the ssh tunnel to the laptop stay up?"),
+]
+
+
+def seed(store, identity, n, rng):
+    """Append n messages on random topics; return {content: topic}."""
+    topics, labels = list(TOPICS), {}
+    for i in range(n):
+        t = rng.choice(topics)
+        line = rng.choice(TOPICS[t]).format(n=rng.randint(2, 90))
+        if i % 2 == 0:
+            content, role = f"note: {line}", "user"
+        else:
+            content, role = f"Got it — {line}. Anything else?", "assistant"
+        store.append(role, content, identity)
+        labels[content] = t
+    return labels
+
+
+def recent_policy(identity, messages):
+    seen = {m["content"] for m in messages}
+    return [m for m in ctl.memory.recent(identity, 20) if m.get("content") not in seen] + messages
+
+
+def tokens(messages):
+    return sum(ctl.est_tokens(m["content"]) for m in messages)
+
+
+def on_topic(topic, messages, labels):
+    """Share of injected memory lines that are about the query's topic."""
+    lines = [ln for m in messages for ln in m["content"].split("\n")]
+    tagged = [t for ln in lines for c, t in labels.items() if c in ln]
+    return sum(t == topic for t in tagged) / len(tagged) if tagged else 0.0
+
+
+def ask(base, model, messages, max_tokens):
+    payload = ctl.chat_payload(model, ctl.inject_sovereign_context(model, messages),
+                               max_tokens, 0, False)
+    req = urllib.request.Request(f"{base}/api/chat", data=json.dumps(payload).encode(), method="POST")
+    req.add_header("Content-Type", "application/json")
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=600) as r:
+        d = json.loads(r.read())
+    return d.get("prompt_eval_count", 0), time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="last-20 memory injection vs relevance recall")
+    ap.add_argument("--url", default=os.environ.get("OLLAMA_URL", "http://127.0.0.1:11434"))
+    ap.add_argument("--model", default="dolphin-mistral")
+    ap.add_argument("--history", type=int, default=400, help="messages seeded into memory")
+    ap.add_argument("--max-tokens", type=int, default=32)
+    ap.add_argument("--dry", action="store_true", help="selection only, no Ollama calls")
+    args = ap.parse_args()
+    base = args.url.rstrip("/")
+
+    ctl.memory = ctl.MemoryStore(root=pathlib.Path(tempfile.mkdtemp(prefix="amallo-bench-")))
+    identity = "bench"
+    labels = seed(ctl.memory, identity, args.history, random.Random(369))
+
+    rows = []
+    for topic, q in QUERIES:
+        msgs = [{"role": "user", "content": q}]
+        row = {"q": q}
+        for name, policy in (("recent", recent_policy), ("recall", ctl.recall_context)):
+            t0 = time.perf_counter()
+            ctx = policy(identity, msgs)
+            sel = time.perf_counter() - t0
+            row[name] = {"est": tokens(ctx), "sel_ms": sel * 1000, "topic": on_topic(topic, ctx, labels)}
+            if not args.dry:
+                row[name]["eval"], row[name]["wall"] = ask(base, args.model, ctx, args.max_tokens)
+        rows.append(row)
+
+    print(f"\nhistory={args.history} k={ctl.RECALL_K} budget={ctl.MEMORY_TOKENS} embedder="
+          f"{ctl.EMBED_MODEL or 'hash'}" + ("" if args.dry else f" model={args.model}") + "\n")
+    cols = "est tok  sel ms  topic" + ("" if args.dry else "  eval tok  wall ms")
+    print(f"{'query':52} | recent: {cols} | recall: {cols}")
+    for r in rows:
+        line = f"{r['q'][:52]:52}"
+        for name in ("recent", "recall"):
+            c = r[name]
+            line += f" | {'':8}{c['est']:>7} {c['sel_ms']:>7.2f} {c['topic']:>6.0%}"
+            if not args.dry:
+                line += f" {c['eval']:>9} {c['wall'] * 1000:>8.0f}"
+        print(line)
+    for key, label in (("est", "est tokens"), ("sel_ms", "selection ms"), ("topic", "on-topic share")) + \
+                      (() if args.dry else (("eval", "prompt eval tokens"), ("wall", "wall s"))):
+        a = statistics.mean(r["recent"][key] for r in rows)
+        b = statistics.mean(r["recall"][key] for r in rows)
+        print(f"\n  mean {label}: recent {a:.2f}, recall {b:.2f}", end="")
+    print()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+prefix-bench — persona prefix reuse, before vs after
+
+Replays a growing multi-turn conversation against Ollama twice:
+
+  before   /api/generate with the flattened build_prompt() string, default keep-alive
+  after    /api/chat with inject_sovereign_context()'s stable layout + keep_alive
+
+and prints Ollama's own prompt_eval_count / prompt_eval_duration for every
+turn. With the prefix cache working, "after" should evaluate only the new
+turn's tokens instead of the whole persona + history.
+
+Usage:
+  python3 tools/prefix-bench.py                      # dolphin-mistral, 6 turns
+  python3 tools/prefix-bench.py --model llama3.2 --turns 10 --url http://127.0.0.1:11434
+"""
+
+import os, sys, json, time, argparse, urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from amallo_controller import inject_sovereign_context, build_prompt, OLLAMA_KEEP_ALIVE
+
+QUESTIONS = [
+    "What is the sovereign node running right now?",
+    "Give me one idea for the mesh router.",
+    "How would you cache model weights across nodes?",
+    "Name a risk in that plan.",
+    "How do we mitigate it?",
+    "Summarize the plan in one line.",
+    "What should I build first tomorrow?",
+    "Anything I'm missing?",
+]
+
+
+def _post(url, payload):
+    req = urllib.request.Request(url, data=json.dumps(payload).encode(), method="POST")
+    req.add_header("Content-Type", "application/json")
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=600) as r:
+        d = json.loads(r.read())
+    d["_wall"] = time.perf_counter() - t0
+    return d
+
+
+def run(mode, base, model, turns, max_tokens):
+    history, rows = [], []
+    opts = {"num_predict": max_tokens, "temperature": 0}
+    for i in range(turns):
+        history.append({"role": "user", "content": QUESTIONS[i % len(QUESTIONS)]})
+        msgs = inject_sovereign_context(model, history)
+        if mode == "before":
+            d = _post(f"{base}/api/generate", {"model": model, "prompt": build_prompt(msgs),
+                                               "stream": False, "options": opts})
+            reply = d.get("response", "")
+        else:
+            d = _post(f"{base}/api/chat", {"model": model, "messages": msgs, "stream": False,
+                                           "keep_alive": OLLAMA_KEEP_ALIVE, "options": opts})
+            reply = d.get("message", {}).get("content", "")
+        history.append({"role": "assistant", "content": reply})
+        rows.append((d.get("prompt_eval_count", 0), d.get("prompt_eval_duration", 0) / 1e6, d["_wall"]))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Ollama prompt-eval before/after stable /api/chat layout")
+    ap.add_argument("--url", default=os.environ.get("OLLAMA_URL", "http://127.0.0.1:11434"))
+    ap.add_argument("--model", default="dolphin-mistral")
+    ap.add_argument("--turns", type=int, default=6)
+    ap.add_argument("--max-tokens", type=int, default=48)
+    args = ap.parse_args()
+    base = args.url.rstrip("/")
+
+    results = {mode: run(mode, base, args.model, args.turns, args.max_tokens)
+               for mode in ("before", "after")}
+
+    print(f"\nmodel={args.model} turns={args.turns}\n")
+    print(f"{'turn':>4} | {'before: tok':>11} {'eval ms':>8} {'wall ms':>8} | "
+          f"{'after: tok':>10} {'eval ms':>8} {'wall ms':>8}")
+    for i in range(args.turns):
+        b, a = results["before"][i], results["after"][i]
+        print(f"{i+1:>4} | {b[0]:>11} {b[1]:>8.0f} {b[2]*1000:>8.0f} | "
+              f"{a[0]:>10} {a[1]:>8.0f} {a[2]*1000:>8.0f}")
+    tb = sum(r[1] for r in results["before"][1:])
+    ta = sum(r[1] for r in results["after"][1:])
+    print(f"\n  prompt-eval after turn 1: before {tb:.0f}ms, after {ta:.0f}ms"
+          + (f" ({tb / ta:.1f}x)" if ta else ""))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,42 +4,26 @@
 import asyncio
 import json
 import os
+import sys
 import aiohttp
 import websockets
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from amallo_keys import KeyStore
+
 OLLAMA_URL = "http://localhost:11434/api/chat"
 KEYS_FILE = "/root/amallo/keys.json"
 VISION_MODEL = "glm4:latest"
 TEXT_MODEL = "dolphin-mistral:latest"
 
 
-def load_valid_tokens():
-    if os.path.exists(KEYS_FILE):
-        try:
-            with open(KEYS_FILE) as f:
-                data = json.load(f)
-            # support list of strings or dict with any shape
-            if isinstance(data, list):
-                return set(data)
-            if isinstance(data, dict):
-                # values may be tokens, or keys may be tokens
-                tokens = set()
-                for k, v in data.items():
-                    if isinstance(v, str):
-                        tokens.add(v)
-                    tokens.add(k)
-                return tokens
-        except Exception as e:
-            print(f"[vision-ws] warning: could not load {KEYS_FILE}: {e}")
-    return None  # fallback mode
-
-
-VALID_TOKENS = load_valid_tokens()
+# Same keys.json as amallo_server / amallo_controller — reloads when they mint or revoke
+KEYS = KeyStore(KEYS_FILE, bootstrap=None) if os.path.exists(KEYS_FILE) else None
 
 
 def is_authorized(token: str) -> bool:
-    if VALID_TOKENS is not None:
-        return token in VALID_TOKENS
+    if KEYS is not None:
+        return KEYS.validate(token)[0]
     return isinstance(token, str) and token.startswith("SOV-")
 
 
@@ -126,8 +110,8 @@ async def handler(ws):
 
 async def main():
     print("[vision-ws] listening on ws://0.0.0.0:8201")
-    if VALID_TOKENS is not None:
-        print(f"[vision-ws] loaded {len(VALID_TOKENS)} token(s) from {KEYS_FILE}")
+    if KEYS is not None:
+        print(f"[vision-ws] loaded {len(KEYS.list_keys())} key(s) from {KEYS_FILE}")
     else:
         print("[vision-ws] fallback auth: accepting any SOV-* token")
     async with websockets.serve(handler, "0.0.0.0", 8201):
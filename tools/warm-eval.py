@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+warm-eval — replay a request log to count cold starts avoided by model warming
+
+Simulates Ollama's resident set (load on request, evict after keep-alive or
+when the memory budget is exceeded, least recently used first) over a request
+log, twice:
+
+  baseline   requests only
+  warmed     plus a ModelWarmer pass every --every seconds: the controller's
+             DemandModel (learning online, it never sees a request early)
+             plans what to preload, and idle unpredicted models are unloaded
+
+and prints cold starts for each, preloads issued and how many of them were
+wasted (evicted before anyone asked for the model).
+
+The log is either the controller's usage.db (per-minute counts, spread across
+the minute) or JSONL lines of {"ts": epoch, "model": name}.
+
+Usage:
+  python3 tools/warm-eval.py --db /root/amallo/usage.db
+  python3 tools/warm-eval.py --log requests.jsonl --budget-gb 16 --keep-alive 5m
+  python3 tools/warm-eval.py --db usage.db --sizes sizes.json   # {"model:tag": bytes}
+"""
+
+import os, sys, json, argparse, sqlite3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from amallo_controller import (DemandModel, ollama_tag, parse_window, WARM_EVERY,
+                               WARM_BUDGET_GB, WARM_UNLOAD_IDLE, OLLAMA_KEEP_ALIVE)
+
+
+def load_db(path):
+    db = sqlite3.connect(path)
+    rows = db.execute("SELECT minute, model, SUM(requests - rejected) FROM usage_minute "
+                      "GROUP BY minute, model ORDER BY minute").fetchall()
+    db.close()
+    events = []
+    for minute, model, n in rows:
+        events += [(minute * 60 + i * 60 / n, ollama_tag(model)) for i in range(n)]
+    return sorted(events)
+
+
+def load_log(path):
+    with open(path) as f:
+        return sorted((float(d["ts"]), ollama_tag(d["model"]))
+                      for d in map(json.loads, filter(str.strip, f)))
+
+
+class Resident:
+    """Ollama's loaded-model set: model -> last use; keep-alive and budget eviction."""
+    def __init__(self, sizes, budget, keep_alive):
+        self.sizes, self.budget, self.keep_alive = sizes, budget, keep_alive
+        self.loaded = {}
+        self.preloaded = set()   # loaded by the warmer and not yet used
+        self.wasted = 0
+
+    def expire(self, ts):
+        for m, last in list(self.loaded.items()):
+            if ts - last > self.keep_alive:
+                self.drop(m)
+
+    def drop(self, m):
+        del self.loaded[m]
+        if m in self.preloaded:
+            self.preloaded.discard(m)
+            self.wasted += 1
+
+    def load(self, ts, m):
+        """Return True if m had to be loaded (a cold start for a request)."""
+        self.expire(ts)
+        cold = m not in self.loaded
+        self.loaded[m] = ts
+        while sum(self.sizes[x] for x in self.loaded) > self.budget and len(self.loaded) > 1:
+            self.drop(min((x for x in self.loaded if x != m), key=self.loaded.get))
+        return cold
+
+
+def simulate(events, sizes, budget, keep_alive, every, warm):
+    res, demand, used = Resident(sizes, budget, keep_alive), DemandModel(), {}
+    cold = preloads = 0
+    next_tick = events[0][0] if events else 0
+    for ts, model in events:
+        while warm and next_tick <= ts:
+            res.expire(next_tick)
+            plan = demand.plan(next_tick, sizes, budget)
+            for m in [m for m in res.loaded if m not in plan
+                      and next_tick - used.get(m, 0) > WARM_UNLOAD_IDLE]:
+                res.drop(m)
+            for m in plan:
+                if m not in res.loaded:
+                    res.load(next_tick, m)
+                    res.preloaded.add(m)
+                    preloads += 1
+            next_tick += every
+        cold += res.load(ts, model)
+        res.preloaded.discard(model)
+        demand.observe(ts, model)
+        used[model] = ts
+    return {"requests": len(events), "cold": cold, "preloads": preloads, "wasted": res.wasted}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay a request log with and without model warming")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--db", help="controller usage.db")
+    src.add_argument("--log", help="JSONL of {ts, model}")
+    ap.add_argument("--sizes", help="JSON {model: bytes}; default --default-gb for every model")
+    ap.add_argument("--default-gb", type=float, default=4.0)
+    ap.add_argument("--budget-gb", type=float, default=WARM_BUDGET_GB)
+    ap.add_argument("--keep-alive", default=OLLAMA_KEEP_ALIVE, help="Ollama keep_alive, e.g. 5m")
+    ap.add_argument("--every", type=int, default=WARM_EVERY, help="seconds between warming passes")
+    args = ap.parse_args()
+
+    events = load_db(args.db) if args.db else load_log(args.log)
+    if not events:
+        print("no requests in log"); return 1
+    sizes = {ollama_tag(k): v for k, v in json.load(open(args.sizes)).items()} if args.sizes else {}
+    for _, m in events:
+        sizes.setdefault(m, int(args.default_gb * 1e9))
+    budget, keep_alive = args.budget_gb * 1e9, parse_window(args.keep_alive, 1800)
+
+    base = simulate(events, sizes, budget, keep_alive, args.every, warm=False)
+    warm = simulate(events, sizes, budget, keep_alive, args.every, warm=True)
+
+    span_h = (events[-1][0] - events[0][0]) / 3600
+    print(f"\n{len(events)} requests over {span_h:.1f}h, {len(sizes)} models, "
+          f"budget {args.budget_gb:g}GB, keep_alive {args.keep_alive}, pass every {args.every}s\n")
+    print(f"{'':10} {'cold starts':>12} {'rate':>7} {'preloads':>9} {'wasted':>7}")
+    for name, r in (("baseline", base), ("warmed", warm)):
+        print(f"{name:10} {r['cold']:>12} {r['cold'] / r['requests']:>7.1%} {r['preloads']:>9} {r['wasted']:>7}")
+    avoided = base["cold"] - warm["cold"]
+    print(f"\n  cold starts avoided: {avoided} ({avoided / base['cold']:.0%} of baseline)" if base["cold"]
+          else "\n  no cold starts in baseline")
+
+
+if __name__ == "__main__":
+    sys.exit(main())